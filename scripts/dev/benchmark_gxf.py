@@ -0,0 +1,205 @@
+#!/bin/python
+
+#------------------- Description & Notes --------------------#
+
+'''
+python benchmark_gxf.py \
+    --gxf ../../data/Homo_sapiens.GRCh38.gtf \
+    --attrs transcript_id gene_id \
+    --benchmark attributes
+'''
+
+## For [Exons], compares the per-transcript construction of exon chains
+## (groupby + apply on strings) against the sort-based one in gxf.getExons.
+
+## For [Memory], outputs the memory footprint of the default and
+## compact (compact=True) tables.
+
+## Compares the per-row implementations that we used to have
+## against their vectorised replacements. Outputs of both must be the
+## same, otherwise the timings don't mean much.
+
+#------------------- Dependencies ---------------------------#
+
+# Standard library imports
+import re
+import time
+from pathlib import Path
+
+# External imports
+import pandas as pd
+
+# Internal imports
+from src import gxf
+from src import io
+from src.util import params
+
+#------------------- Constants ------------------------------#
+
+#------------------- Public Classes & Functions -------------#
+
+#------------------- Protected Classes & Functions ----------#
+
+#------------------- Private Classes & Functions ------------#
+
+def readRawTable(gxfFile):
+    colNames = ['seqname', 'source', 'feature', 'start',
+                'end', 'score', 'strand', 'frame', 'attribute']
+    mDf      = pd.read_csv(gxfFile, sep='\t', comment='#',
+        header=None, names=colNames, low_memory=False)
+    return mDf
+
+def parseAttributesPerRow(row, gxfType, attrs):
+    if (gxfType == io.gxf.GFF):
+        l = dict(x.split('=') for x in row.split(';'))
+
+    else:
+        l = {}
+        for x in row.split('; '):
+            m = re.match('(.*) "(.*)"', x)
+            k = m.group(1)
+            v = m.group(2)
+            l[k] =v
+
+    l = pd.Series(l)
+    if (len(attrs) != 0):
+        colsToRemove = set(l.index).difference(attrs)
+        l = l.drop(colsToRemove)
+
+    return l
+
+def benchmarkAttributes(gxfFile, attrs):
+    f       = Path(gxfFile).stem if io.common.isZFile(gxfFile) else gxfFile
+    gxfType = io.gxf._getFormat(f)
+    mDf     = readRawTable(gxfFile)
+    print("Rows:\t{}".format(len(mDf)))
+
+    ## Per-row
+    sTime  = time.time()
+    f      = lambda x: parseAttributesPerRow(x, gxfType, attrs)
+    rowDf  = mDf['attribute'].apply(f)
+    rowT   = time.time() - sTime
+
+    ## Vectorised
+    sTime  = time.time()
+    colDf  = io.gxf._parseAttributes(mDf['attribute'], gxfType, attrs)
+    colT   = time.time() - sTime
+
+    ## Check that we get the same table
+    pd.testing.assert_index_equal(rowDf.columns.sort_values(),
+        colDf.columns.sort_values())
+    rowDf  = rowDf[colDf.columns].astype(object)
+    colDf  = colDf.astype(object)
+    pd.testing.assert_frame_equal(rowDf, colDf)
+    return (rowT, colT)
+
+def getExonsPerGroup(gtfDf):
+    cond = (gtfDf['feature'] == 'exon')
+    eDf  = gtfDf[cond][['start', 'end', 'transcript_id']]
+    eDf['start_end'] = '(' + eDf['start'].astype(str) \
+                           + '-' + eDf['end'].astype(str) + ')'
+    f = lambda x: ','.join(set(x))
+    eDf = eDf.groupby(['transcript_id'], observed=True)['start_end'].apply(f)
+    eDf = eDf.reset_index()
+    eDf = eDf.rename(columns={'start_end':'exon_list'})
+
+    f = lambda x: ','.join(sortExonStrList(x.split(',')))
+    eDf['exon_list'] = eDf['exon_list'].apply(f)
+    return eDf
+
+def sortExonStrList(exStrList):
+    exStrList = [tuple(re.sub('[()]', '', e).split('-')) for e in exStrList]
+    exStrList = [(int(e[0]), int(e[1])) for e in exStrList]
+    exStrList.sort(key=lambda x: x[0])
+    exStrList = ["({}-{})".format(e[0], e[1]) for e in exStrList]
+    return exStrList
+
+def benchmarkExons(gxfFile, attrs):
+    attrs = list(set(attrs + ['transcript_id']))
+    gxfDf = list(io.gxf.read(gxfFile, attrs=attrs, cache=False))[0]
+    print("Transcripts:\t{}".format(gxfDf['transcript_id'].nunique()))
+
+    ## Per-transcript
+    sTime  = time.time()
+    grpDf  = getExonsPerGroup(gxfDf)
+    grpT   = time.time() - sTime
+
+    ## Vectorised
+    sTime  = time.time()
+    vecDf  = gxf.getExons(gxfDf)
+    vecT   = time.time() - sTime
+
+    ## Check that we get the same table once exon chains are
+    ## converted back into strings
+    vecDf  = gxf.formatExons(vecDf)
+    pd.testing.assert_frame_equal(grpDf, vecDf)
+    return (grpT, vecT)
+
+def benchmarkMemory(gxfFile, attrs):
+    kwargs = {'attrs':attrs, 'cache':False}
+    gxfDf  = list(io.gxf.read(gxfFile, **kwargs))[0]
+    cGxfDf = list(io.gxf.read(gxfFile, compact=True, **kwargs))[0]
+
+    ## Check that we get the same transcripts from both tables
+    if ('transcript_id' in gxfDf.columns):
+        tDf  = gxf.getTranscripts(gxfDf)
+        cTDf = gxf.getTranscripts(cGxfDf).astype(tDf.dtypes.to_dict())
+        pd.testing.assert_frame_equal(tDf, cTDf)
+
+    ## Memory usage of each column
+    toMB = lambda x: x.memory_usage(deep=True) / (1024 ** 2)
+    mDf  = pd.concat([toMB(gxfDf), toMB(cGxfDf)], axis=1)
+    mDf.columns = ['Default (MB)', 'Compact (MB)']
+    mDf.loc['Total'] = mDf.sum()
+    mDf['Reduction'] = mDf['Default (MB)'] / mDf['Compact (MB)']
+    return mDf
+
+def printTimes(name, oldT, newT):
+    print(name)
+    print("Per-row (s):\t{:.3f}".format(oldT))
+    print("Vectorised (s):\t{:.3f}".format(newT))
+    print("Speed-up:\t{:.1f}x".format(oldT / newT))
+
+def main():
+    ## **********
+    ## *** Parse command-line arguemnts
+    ## **********
+    argParser = params.ArgParser()
+    argParser.add_argument("--gxf", help="GTF/GFF file",
+        nargs=1, type=argParser.isFile, required=True)
+    argParser.add_argument("--attrs", help="Attributes to parse",
+        nargs='*', default=[])
+    argParser.add_argument("--benchmark", help="[Attributes], [Exons] \
+        or [Memory]",
+        nargs=1, required=True)
+    args = argParser.parse_args()
+
+    gxfFile  = args.gxf[0]
+    attrs    = args.attrs
+    bMetric  = args.benchmark[0].upper()
+
+    if (bMetric != 'ATTRIBUTES' and bMetric != 'EXONS'
+        and bMetric != 'MEMORY'):
+        raise ValueError('Invalid option.')
+
+    ## **********
+    ## *** Run - Benchmark GXF parsing
+    ## **********
+    if (bMetric == 'ATTRIBUTES'):
+        (oldT, newT) = benchmarkAttributes(gxfFile, attrs)
+        printTimes('Attribute parsing', oldT, newT)
+
+    elif (bMetric == 'EXONS'):
+        (oldT, newT) = benchmarkExons(gxfFile, attrs)
+        printTimes('Exon chains', oldT, newT)
+
+    elif (bMetric == 'MEMORY'):
+        mDf = benchmarkMemory(gxfFile, attrs)
+        print(mDf.to_string(float_format='{:.2f}'.format))
+
+#------------------- Main -----------------------------------#
+
+if (__name__ == "__main__"):
+    main()
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,186 @@
+#!/bin/python
+
+#------------------- Description & Notes --------------------#
+
+'''
+python benchmark_xam.py \
+    --xam ../../output/RNA-seq/alignments/ont_minimap2_sorted.bam \
+    --benchmark stats
+'''
+
+## For [Stats], compares the statistics of each alignment from the
+## regex-based functions (i.e., getSoftClipCount, getMismatches, etc.)
+## against xam.getAlignmentStats (per alignment) and
+## xam.getAlignmentStatsTable (all alignments at once).
+
+## For [Blocks], compares the aligned blocks (i.e., exons) and junctions
+## of each alignment from xam.cigartuplesToGenomicCoordinates (per
+## alignment) against xam.cigarsToGenomicCoordinates (all alignments
+## at once, from CIGAR strings).
+
+## Outputs of both must be the same, otherwise the timings
+## don't mean much.
+
+#------------------- Dependencies ---------------------------#
+
+# Standard library imports
+import time
+
+# External imports
+import pandas as pd
+
+# Internal imports
+from src import io
+from src import ops
+from src import xam
+from src.util import params
+
+#------------------- Constants ------------------------------#
+
+#------------------- Public Classes & Functions -------------#
+
+#------------------- Protected Classes & Functions ----------#
+
+#------------------- Private Classes & Functions ------------#
+
+def readAlignments(xamFile, nAligns, threads):
+    ## Mapped alignments with an MD tag
+    xamRecs = []
+    for x in io.xam.read(xamFile, threads=threads):
+        if (x.is_unmapped or not x.has_tag('MD')):
+            continue
+
+        xamRecs.append((x.cigarstring, x.cigartuples, x.get_tag('MD'),
+            x.reference_start + 1))
+        if (nAligns is not None and len(xamRecs) == nAligns):
+            break
+
+    return xamRecs
+
+def getAlignmentStatsPerRegex(cigarString, mdTag):
+    sClipCount = xam.getSoftClipCount(cigarString)
+    hClipCount = xam.getHardClipCount(cigarString)
+    stats = {'softClipCount':sClipCount, 'hardClipCount':hClipCount,
+             'totalClips':sClipCount + hClipCount}
+
+    mm = [len(x) for x in xam.getMismatches(mdTag)]
+    i  = xam.getInsertions(cigarString)
+    d  = xam.getDeletions(cigarString)
+    stats.update({'matchCount':sum(xam.getMatches(mdTag)),
+        'mismatchCount':sum(mm), 'insertionCount':sum(i),
+        'deletionCount':sum(d)})
+
+    for name, l in [('Mismatch', mm), ('Insertion', i), ('Deletion', d)]:
+        total = sum(l)
+        stats['min{}Len'.format(name)] = 0 if total == 0 else min(l)
+        stats['max{}Len'.format(name)] = 0 if total == 0 else max(l)
+        stats['avg{}Len'.format(name)] = 0 if total == 0 else (total / len(l))
+
+    return stats
+
+def benchmarkStats(xamFile, nAligns, threads):
+    xamRecs = readAlignments(xamFile, nAligns, threads)
+    print("Alignments:\t{}".format(len(xamRecs)))
+
+    ## Per-regex
+    sTime  = time.time()
+    reDf   = [getAlignmentStatsPerRegex(x[0], x[2]) for x in xamRecs]
+    reT    = time.time() - sTime
+
+    ## Single-pass
+    sTime  = time.time()
+    spDf   = [xam.getAlignmentStats(x[1], x[2]) for x in xamRecs]
+    spT    = time.time() - sTime
+
+    ## Batch
+    sTime  = time.time()
+    bDf    = xam.getAlignmentStatsTable([x[1] for x in xamRecs],
+        [x[2] for x in xamRecs])
+    bT     = time.time() - sTime
+
+    ## Check that we get the same table
+    reDf   = pd.DataFrame(reDf, columns=bDf.columns)
+    spDf   = pd.DataFrame(spDf, columns=bDf.columns)
+    pd.testing.assert_frame_equal(reDf, spDf, check_dtype=False)
+    pd.testing.assert_frame_equal(reDf, bDf, check_dtype=False)
+    return (reT, spT, bT)
+
+def benchmarkBlocks(xamFile, nAligns, threads):
+    xamRecs = readAlignments(xamFile, nAligns, threads)
+    print("Alignments:\t{}".format(len(xamRecs)))
+
+    ## Per-alignment
+    sTime  = time.time()
+    exss   = [xam.cigartuplesToGenomicCoordinates(x[3], x[1])
+              for x in xamRecs]
+    junss  = [ops.exonsToJunctions(x) for x in exss]
+    alignT = time.time() - sTime
+
+    ## Batch
+    sTime  = time.time()
+    (cOps, cLens, cOffsets) = xam.parseCigarStrings(
+        [x[0] for x in xamRecs])
+    (eStarts, eEnds, eOffsets) = xam.cigarsToGenomicCoordinates(
+        [x[3] for x in xamRecs], cOps, cLens, cOffsets)
+    (jStarts, jEnds, jOffsets) = xam.blocksToJunctions(
+        eStarts, eEnds, eOffsets)
+    bExss  = xam.blocksToTuples(eStarts, eEnds, eOffsets)
+    bJunss = xam.blocksToTuples(jStarts, jEnds, jOffsets)
+    bT     = time.time() - sTime
+
+    ## Check that we get the same blocks
+    if (exss != bExss or junss != bJunss):
+        raise AssertionError("Blocks are different")
+
+    return (alignT, bT)
+
+def printTimes(name, oldT, newTs, oldName='Per-regex'):
+    print(name)
+    print("{} (s):\t{:.3f}".format(oldName, oldT))
+    for k, newT in newTs:
+        print("{} (s):\t{:.3f}".format(k, newT))
+        print("Speed-up:\t{:.1f}x".format(oldT / newT))
+
+def main():
+    ## **********
+    ## *** Parse command-line arguemnts
+    ## **********
+    argParser = params.ArgParser()
+    argParser.add_argument("--xam", help="SAM/BAM file",
+        nargs=1, type=argParser.isFile, required=True)
+    argParser.add_argument("--naligns", help="Number of alignments to use",
+        nargs=1, type=argParser.isGTZeroInt)
+    argParser.add_argument("--threads", help="Number of threads for \
+        decompressing BAM files", nargs=1, type=argParser.isGTZeroInt,
+        default=[1])
+    argParser.add_argument("--benchmark", help="[Stats] or [Blocks]",
+        nargs=1, required=True)
+    args = argParser.parse_args()
+
+    xamFile  = args.xam[0]
+    nAligns  = args.naligns[0] if args.naligns is not None else None
+    threads  = args.threads[0]
+    bMetric  = args.benchmark[0].upper()
+
+    if (bMetric != 'STATS' and bMetric != 'BLOCKS'):
+        raise ValueError('Invalid option.')
+
+    ## **********
+    ## *** Run - Benchmark XAM parsing
+    ## **********
+    if (bMetric == 'STATS'):
+        (reT, spT, bT) = benchmarkStats(xamFile, nAligns, threads)
+        printTimes('Alignment statistics', reT,
+            [('Single-pass', spT), ('Batch', bT)])
+
+    elif (bMetric == 'BLOCKS'):
+        (alignT, bT) = benchmarkBlocks(xamFile, nAligns, threads)
+        printTimes('Aligned blocks', alignT, [('Batch', bT)],
+            'Per-alignment')
+
+#------------------- Main -----------------------------------#
+
+if (__name__ == "__main__"):
+    main()
+
+#------------------------------------------------------------------------------
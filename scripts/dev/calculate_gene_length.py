@@ -17,6 +17,9 @@ from src.util import params
 
 #------------------- Constants ------------------------------#
 
+GXF_ATTRS    = ['ID', 'biotype']
+GXF_FEATURES = ['gene']
+
 #------------------- Public Classes & Functions -------------#
 
 #------------------- Protected Classes & Functions ----------#
@@ -48,7 +51,8 @@ def main():
     ## **********
     ## *** Run - Calculate length of each transcript
     ## **********
-    gxfDf = list(io.gxf.read(gxfFile))[0]
+    gxfDf = list(io.gxf.read(gxfFile, attrs=GXF_ATTRS,
+        features=GXF_FEATURES))[0]
     lenDf = calculateGeneLength(gxfDf)
     lenDf.to_csv(oFile, sep='\t', index=False)
 
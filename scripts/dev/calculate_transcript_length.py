@@ -17,6 +17,8 @@ from src.util import params
 
 #------------------- Constants ------------------------------#
 
+GXF_ATTRS = ['ID', 'Parent', 'biotype']
+
 #------------------- Public Classes & Functions -------------#
 
 #------------------- Protected Classes & Functions ----------#
@@ -70,7 +72,7 @@ def main():
     ## **********
     ## *** Run - Calculate length and number of exons of each transcript
     ## **********
-    gxfDf = list(io.gxf.read(gxfFile))[0]
+    gxfDf = list(io.gxf.read(gxfFile, attrs=GXF_ATTRS))[0]
     lenDf = calculateTranscriptLength(gxfDf)
     eDf   = calculateExonCount(gxfDf)
     df    = lenDf.merge(eDf, on='ID', how='left')
@@ -8,12 +8,17 @@ python compare_peptides.py \
                 ../../output/MS/peptides/illumina_R1_bbduk_peptides.txt \
     --outputcount count.txt \
     --outputdata data.txt
+
+python compare_peptides.py \
+    --inputfile ../../output/MS/peptides/ont_peptides.txt  \
+                ../../output/MS/peptides/illumina_R1_bbduk_peptides.txt \
+    --approximate \
+    --outputcount count.txt
 '''
 
 #------------------- Dependencies ---------------------------#
 
 # Standard library imports
-import functools
 
 # External imports
 import pandas as pd
@@ -25,6 +30,8 @@ from src.util import params
 
 #------------------- Constants ------------------------------#
 
+CHUNK_SIZE = 1000000
+
 #------------------- Public Classes & Functions -------------#
 
 #------------------- Protected Classes & Functions ----------#
@@ -54,11 +61,28 @@ def comparePeptides(pepDfs, iFiles):
               for pepDf, f in zip(pepDfs, iFiles)]
 
     ## Summarise info for each data
-    f      = lambda x, y: x.merge(y, on=cols, how='outer')
-    dDf    = functools.reduce(f, pepDfs)
+    dDf    = ops.mergeData(pepDfs, cols)
     dDf    = dDf.drop(columns=['Sequence'])
     return (cDf, dDf)
 
+def sketchPeptides(iFiles, precision):
+    ## Two peptides are the same if they have the same sequence.
+    ## Files are read in chunks so that we never hold all
+    ## peptides in memory
+    cols    = ['Sequence']
+    pepDict = {}
+    for f in iFiles:
+        sketch = ops.HyperLogLog(precision)
+        for pepDf in pd.read_csv(f, sep='\t', usecols=cols,
+            chunksize=CHUNK_SIZE):
+            sketch.update(ops.hashRows(pepDf, cols))
+
+        pepDict[f] = sketch
+
+    ## Estimate counts for each data (i.e., Venn diagram)
+    cDf = ops.compareSketches(pepDict)
+    return cDf
+
 def main():
     ## **********
     ## *** Parse command-line arguemnts
@@ -66,25 +90,42 @@ def main():
     argParser = params.ArgParser()
     argParser.add_argument("--inputfile", help="PD Peptide file",
         nargs='+', type=argParser.isFile, required=True)
+    argParser.add_argument("--approximate", help="Estimate counts with \
+        HyperLogLog sketches. Requires much less memory, but counts have \
+        an error (see StdError) and no data file is written",
+        action='store_true')
+    argParser.add_argument("--precision", help="Precision of sketches \
+        (8-18). Higher is more accurate but slower", nargs=1,
+        type=argParser.isGTZeroInt, default=[ops.sketch.PRECISION])
     argParser.add_argument("--outputcount", help="Output count file",
         nargs=1, required=True)
     argParser.add_argument("--outputdata", help="Output data file",
-        nargs=1, required=True)
+        nargs=1)
     args = argParser.parse_args()
 
     iFiles     = args.inputfile
+    approx     = args.approximate
+    precision  = args.precision[0]
     oCountFile = args.outputcount[0]
-    oDataFile  = args.outputdata[0]
+    oDataFile  = args.outputdata[0] if args.outputdata is not None else None
+    if (not approx and oDataFile is None):
+        raise ValueError('Must have an output data file.')
 
     ## **********
     ## *** Run - Compare unique peptides
     ## **********
-    dfs = [parsePDPFile(f) for f in iFiles]
-
-    ## How many peptides are present in each dataset?
-    (cDf, dDf) = comparePeptides(dfs, iFiles)
-    cDf.to_csv(oCountFile, sep='\t', index=False)
-    dDf.to_csv(oDataFile, sep='\t', index=False)
+    if (approx):
+        ## Roughly how many peptides are present in each dataset?
+        cDf = sketchPeptides(iFiles, precision)
+        cDf.to_csv(oCountFile, sep='\t', index=False)
+
+    else:
+        dfs = [parsePDPFile(f) for f in iFiles]
+
+        ## How many peptides are present in each dataset?
+        (cDf, dDf) = comparePeptides(dfs, iFiles)
+        cDf.to_csv(oCountFile, sep='\t', index=False)
+        dDf.to_csv(oDataFile, sep='\t', index=False)
 
 #------------------- Main -----------------------------------#
 
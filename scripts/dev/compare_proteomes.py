@@ -25,7 +25,6 @@ python compare_proteomes.py \
 #------------------- Dependencies ---------------------------#
 
 # Standard library imports
-import functools
 
 # External imports
 
@@ -37,6 +36,9 @@ from src.util import params
 
 #------------------- Constants ------------------------------#
 
+GXF_ATTRS    = ['transcript_id', 'gene_id', 'ref_gene_id', 'reference_id']
+GXF_FEATURES = ['transcript', 'exon']
+
 #------------------- Public Classes & Functions -------------#
 
 #------------------- Protected Classes & Functions ----------#
@@ -51,7 +53,9 @@ def identifyProteoforms(k, v, refGxf, refTdf):
 
 def compareTranscripts(tDfs, gxfFiles):
     ## Two transcripts are the same if they have the same genomic coordinates
-    cols = ['start', 'end', 'seqname', 'strand', 'exon_list']
+    ## We compare the structure keys of transcripts rather than
+    ## the structures themselves; they're much cheaper to merge
+    cols = [gxf.transcript.STRUCTURE_KEY]
 
     ## Summarise counts for each data (i.e., Venn diagram)
     tDict = {f:ops.toSet(tDf, cols) for tDf, f in zip(tDfs, gxfFiles)}
@@ -61,9 +65,10 @@ def compareTranscripts(tDfs, gxfFiles):
     tDfs = [tDf.rename(columns={'transcript_ids':f, 'transcript_id':f})
             for tDf, f in zip(tDfs, gxfFiles)]
 
-    ## Summarise info for each data
-    f    = lambda x, y: x.merge(y, on=cols, how='outer')
-    dDf  = functools.reduce(f, tDfs)
+    ## Summarise info for each data, then add the structures back
+    sCols = gxf.transcript.STRUCTURE_COLS
+    dDf   = ops.mergeData([tDf.drop(columns=sCols) for tDf in tDfs], cols)
+    dDf   = gxf.transcript.joinStructures(dDf, tDfs)
     return (cDf, dDf)
 
 def identifyKnownProteoforms(pDf, gtRefDf):
@@ -83,13 +88,14 @@ def identifyKnownProteoforms(pDf, gtRefDf):
 def getProteins(pDf):
     pDf = pDf.drop(columns=['ref_transcript_id']).drop_duplicates()
     f  = lambda x: ','.join(set(x))
-    pDf = pDf.groupby(['ref_gene_id'])['transcript_id'].apply(f)
+    pDf = pDf.groupby(['ref_gene_id'], observed=True)['transcript_id'].apply(f)
     pDf = pDf.reset_index()
     return pDf
 
 def getProteoforms(pDf):
     f  = lambda x: ','.join(set(x))
-    pDf = pDf.groupby(['ref_gene_id', 'transcript_id'])['ref_transcript_id'].apply(f)
+    pDf = pDf.groupby(['ref_gene_id', 'transcript_id'], observed=True) \
+        ['ref_transcript_id'].apply(f)
     pDf = pDf.reset_index()
     pDf = pDf[['ref_gene_id', 'ref_transcript_id', 'transcript_id']]
     return pDf
@@ -110,7 +116,7 @@ def getASProteoforms(pDf):
 def getASGenes(pDf):
     pDf = pDf.drop(columns=['ref_transcript_id'])
     f  = lambda x: ','.join(set(x))
-    pDf = pDf.groupby(['ref_gene_id'])['transcript_id'].apply(f)
+    pDf = pDf.groupby(['ref_gene_id'], observed=True)['transcript_id'].apply(f)
     pDf = pDf.reset_index()
     return pDf
 
@@ -184,8 +190,7 @@ def compareProteins(tDfs, gxfFiles):
             for tDf, f in zip(tDfs, gxfFiles)]
 
     ## Summarise info for each data
-    f    = lambda x, y: x.merge(y, on=cols, how='outer')
-    dDf  = functools.reduce(f, tDfs)
+    dDf  = ops.mergeData(tDfs, cols)
     return (cDf, dDf)
 
 def compareProteoforms(tDfs, gxfFiles):
@@ -201,8 +206,7 @@ def compareProteoforms(tDfs, gxfFiles):
             for tDf, f in zip(tDfs, gxfFiles)]
 
     ## Summarise info for each data
-    f    = lambda x, y: x.merge(y, on=cols, how='outer')
-    dDf  = functools.reduce(f, tDfs)
+    dDf  = ops.mergeData(tDfs, cols)
     return (cDf, dDf)
 
 def identifyNovelProteoforms(pDf, gtfDf):
@@ -247,6 +251,10 @@ def main():
         [ASProteoform] or [ASGene]", nargs=1, required=True)
     argParser.add_argument("--format", help="[Known] or [Novel]",
         nargs=1, required=True)
+    argParser.add_argument("--compact", help="Use compact column types \
+        to reduce memory usage", action='store_true')
+    argParser.add_argument("--nworkers", help="Number of GXF files to \
+        parse in parallel", nargs=1, type=argParser.isGTZeroInt, default=[1])
     argParser.add_argument("--outputcount", help="Output count file",
         nargs=1, required=True)
     argParser.add_argument("--outputdata", help="Output data file",
@@ -257,6 +265,8 @@ def main():
     refGxf     = args.refgxf[0]
     oMetric    = args.metric[0].upper()
     oFormat    = args.format[0].upper()
+    compact    = args.compact
+    nWorkers   = args.nworkers[0]
     oCountFile = args.outputcount[0]
     oDataFile  = args.outputdata[0]
 
@@ -272,7 +282,8 @@ def main():
     ## **********
     ## Find the unique proteoforms in each dataset based on
     ## the genomic coordinates of transcripts
-    gxfDfs = list(io.gxf.read(*gxfFiles))
+    gxfDfs = list(io.gxf.read(*gxfFiles, attrs=GXF_ATTRS,
+        features=GXF_FEATURES, compact=compact, nWorkers=nWorkers))
     tDfs   = [gxf.getTranscripts(gxfDf) for gxfDf in gxfDfs]
     tDfs   = [gxf.transcript.dropDuplicates(tDf) for tDf in tDfs]
     tDict  = {f:tDf for f, tDf in zip(gxfFiles, tDfs)}
@@ -311,6 +322,8 @@ def main():
         ## Compare identified proteomes
         (cDf, dDf) = compareNovelProteomes(pDict, oMetric)
         cDf.to_csv(oCountFile, sep='\t', index=False)
+        dDf = dDf.drop(columns=[gxf.transcript.STRUCTURE_KEY])
+        dDf = gxf.formatExons(dDf)
         dDf.to_csv(oDataFile, sep='\t', index=False)
 
 #------------------- Main -----------------------------------#
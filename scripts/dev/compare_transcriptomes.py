@@ -13,7 +13,6 @@ time python compare_trascriptomes.py \
 #------------------- Dependencies ---------------------------#
 
 # Standard library imports
-import functools
 import itertools
 
 # External imports
@@ -27,13 +26,16 @@ from src.util import params
 
 #------------------- Constants ------------------------------#
 
+GXF_ATTRS    = ['transcript_id', 'gene_id']
+GXF_FEATURES = ['transcript', 'exon']
+
 #------------------- Public Classes & Functions -------------#
 
 #------------------- Protected Classes & Functions ----------#
 
 #------------------- Private Classes & Functions ------------#
 
-def compareTranscripts(tDfs, gxfFiles):
+def compareTranscripts(tDfs, gxfFiles, precision=None):
     ## Two transcripts are the same if they have the same genomic coordinates.
     ## Specifically, transcripts must have:
     ## * The same chromosome
@@ -45,7 +47,13 @@ def compareTranscripts(tDfs, gxfFiles):
     ## have the same genomic coordinates? In this case, we can't do much about
     ## these... However, can be a bit problematic when we consider alternatively
     ## spliced transcripts
-    cols = ['start', 'end', 'seqname', 'strand', 'exon_list']
+
+    ## We compare the structure keys of transcripts rather than
+    ## the structures themselves; they're much cheaper to merge
+    cols = [gxf.transcript.STRUCTURE_KEY]
+    if (precision is not None):
+        cDf = sketchData(tDfs, gxfFiles, cols, precision)
+        return (cDf, None)
 
     ## Summarise counts for each data (i.e., Venn diagram)
     tDict = {f:ops.toSet(tDf, cols) for tDf, f in zip(tDfs, gxfFiles)}
@@ -55,13 +63,14 @@ def compareTranscripts(tDfs, gxfFiles):
     tDfs = [tDf.rename(columns={'transcript_ids':f, 'transcript_id':f})
             for tDf, f in zip(tDfs, gxfFiles)]
 
-    ## Summarise info for each data
-    f    = lambda x, y: x.merge(y, on=cols, how='outer')
-    dDf  = functools.reduce(f, tDfs)
+    ## Summarise info for each data, then add the structures back
+    sCols = gxf.transcript.STRUCTURE_COLS
+    dDf   = ops.mergeData([tDf.drop(columns=sCols) for tDf in tDfs], cols)
+    dDf   = gxf.transcript.joinStructures(dDf, tDfs)
     return (cDf, dDf)
 
 def printTranscriptsPerGene(df, f):
-    df = df.groupby('gene_id').count().reset_index()
+    df = df.groupby('gene_id', observed=True).count().reset_index()
     minCount  = df['transcript_ids'].min()
     maxCount  = df['transcript_ids'].max()
     meanCount = df['transcript_ids'].mean()
@@ -71,7 +80,7 @@ def printTranscriptsPerGene(df, f):
     print("Max. transcripts:\t{}".format(str(maxCount)))
     print("Mean. transcripts:\t{}".format(str(meanCount)))
 
-def compareGenes(tDfs, gxfFiles):
+def compareGenes(tDfs, gxfFiles, precision=None):
     ## Two genes are the same if they have the same genomic coordinates.
     ## Specifically, genes must have:
     ## * The same chromosome
@@ -87,13 +96,17 @@ def compareGenes(tDfs, gxfFiles):
 
         ## Remove duplicates and collapse IDs
         f  = lambda x: ','.join(set(x))
-        df = df.groupby('gene_id')['transcript_ids'].apply(f)
+        df = df.groupby('gene_id', observed=True)['transcript_ids'].apply(f)
         df = df.reset_index()
         return df
 
     ## Summarise counts for each data (i.e., Venn diagram)
     tDfs  = [f(tDf) for tDf in tDfs]
     cols  = ['gene_id']
+    if (precision is not None):
+        cDf = sketchData(tDfs, gxfFiles, cols, precision)
+        return (cDf, None)
+
     tDict = {f:ops.toSet(tDf, cols) for tDf, f in zip(tDfs, gxfFiles)}
     cDf   = ops.compareData(tDict)
 
@@ -102,10 +115,26 @@ def compareGenes(tDfs, gxfFiles):
             for tDf, f in zip(tDfs, gxfFiles)]
 
     ## Summarise info for each data
-    f    = lambda x, y: x.merge(y, on=cols, how='outer')
-    dDf  = functools.reduce(f, tDfs)
+    dDf  = ops.mergeData(tDfs, cols)
     return (cDf, dDf)
 
+def sketchData(tDfs, gxfFiles, cols, precision):
+    ## Estimate counts for each data (i.e., Venn diagram) without
+    ## holding the elements of each data as sets
+    tDict = {f:ops.toSketch(tDf, cols, precision)
+             for tDf, f in zip(tDfs, gxfFiles)}
+    cDf   = ops.compareSketches(tDict)
+    return cDf
+
+def writeData(dDf, oDataFile):
+    ## There's no data table when counts are estimated
+    if (dDf is None):
+        return
+
+    dDf = dDf.drop(columns=[gxf.transcript.STRUCTURE_KEY], errors='ignore')
+    dDf = gxf.formatExons(dDf)
+    dDf.to_csv(oDataFile, sep='\t', index=False)
+
 def main():
     ## **********
     ## *** Parse command-line arguemnts
@@ -115,19 +144,46 @@ def main():
         nargs='+', type=argParser.isFile, required=True)
     argParser.add_argument("--metric", help="[Transcript], [ASTranscript] \
         or [ASGene]", nargs=1, required=True)
+    argParser.add_argument("--compact", help="Use compact column types \
+        to reduce memory usage", action='store_true')
+    argParser.add_argument("--nworkers", help="Number of GXF files to \
+        parse in parallel", nargs=1, type=argParser.isGTZeroInt, default=[1])
+    argParser.add_argument("--region", help="Only compare transcripts \
+        within a region (i.e., chr1:1-5000000). GXF files are indexed \
+        if required", nargs=1)
+    argParser.add_argument("--approximate", help="Estimate counts with \
+        HyperLogLog sketches. Requires much less memory, but counts have \
+        an error (see StdError) and no data file is written. Up to {} \
+        GXF files".format(ops.sketch.MAX_SETS),
+        action='store_true')
+    argParser.add_argument("--precision", help="Precision of sketches \
+        (8-18). Higher is more accurate but slower", nargs=1,
+        type=argParser.isGTZeroInt, default=[ops.sketch.PRECISION])
     argParser.add_argument("--outputcount", help="Output count file",
         nargs=1, required=True)
     argParser.add_argument("--outputdata", help="Output data file",
-        nargs=1, required=True)
+        nargs=1)
     args = argParser.parse_args()
 
     gxfFiles   = args.gxf
     oMetric    = args.metric[0].upper()
+    compact    = args.compact
+    nWorkers   = args.nworkers[0]
+    region     = args.region[0] if args.region is not None else None
+    precision  = args.precision[0] if args.approximate else None
     oCountFile = args.outputcount[0]
-    oDataFile  = args.outputdata[0]
+    oDataFile  = args.outputdata[0] if args.outputdata is not None else None
+    if (precision is None and oDataFile is None):
+        raise ValueError('Must have an output data file.')
+
     if (len(gxfFiles) < 2):
         raise ValueError('Must have at least 2 GXF files to compare.')
 
+    if (precision is not None and len(gxfFiles) > ops.sketch.MAX_SETS):
+        errMsg = 'Must have at most {} GXF files to compare with sketches.' \
+            .format(ops.sketch.MAX_SETS)
+        raise ValueError(errMsg)
+
     if (oMetric != 'TRANSCRIPT' and oMetric != 'ASTRANSCRIPT' and oMetric != 'ASGENE'):
         raise ValueError('Invalid option.')
 
@@ -135,7 +191,9 @@ def main():
     ## *** Run - Compare unique transcripts
     ## **********
     ## Find all transcripts
-    gxfDfs = list(io.gxf.read(*gxfFiles))
+    gxfDfs = list(io.gxf.read(*gxfFiles, attrs=GXF_ATTRS,
+        features=GXF_FEATURES, compact=compact, nWorkers=nWorkers,
+        region=region))
     tDfs   = [gxf.getTranscripts(gxfDf) for gxfDf in gxfDfs]
 
     if (oMetric == 'TRANSCRIPT'):
@@ -143,9 +201,9 @@ def main():
         tDfs = [gxf.transcript.dropDuplicates(tDf) for tDf in tDfs]
 
         ## How many transcripts are present in each dataset?
-        (cDf, dDf) = compareTranscripts(tDfs, gxfFiles)
+        (cDf, dDf) = compareTranscripts(tDfs, gxfFiles, precision)
         cDf.to_csv(oCountFile, sep='\t', index=False)
-        dDf.to_csv(oDataFile, sep='\t', index=False)
+        writeData(dDf, oDataFile)
 
     else:
         ## Find all alternatively spliced transcripts
@@ -161,9 +219,9 @@ def main():
             tDfs = [tDf.drop(columns=['gene_id']) for tDf in tDfs]
 
             ## How many (AS) transcripts are present in each dataset?
-            (cDf, dDf) = compareTranscripts(tDfs, gxfFiles)
+            (cDf, dDf) = compareTranscripts(tDfs, gxfFiles, precision)
             cDf.to_csv(oCountFile, sep='\t', index=False)
-            dDf.to_csv(oDataFile, sep='\t', index=False)
+            writeData(dDf, oDataFile)
 
         elif (oMetric == 'ASGENE'):
             ## This will ONLY work properly if the IDs in each dataset are
@@ -173,9 +231,9 @@ def main():
             [printTranscriptsPerGene(tDf, f) for tDf, f in zip(tDfs, gxfFiles)]
 
             ## How many genes expressing AS transcripts are present in each dataset?
-            (cDf, dDf) = compareGenes(tDfs, gxfFiles)
+            (cDf, dDf) = compareGenes(tDfs, gxfFiles, precision)
             cDf.to_csv(oCountFile, sep='\t', index=False)
-            dDf.to_csv(oDataFile, sep='\t', index=False)
+            writeData(dDf, oDataFile)
 
 #------------------- Main -----------------------------------#
 
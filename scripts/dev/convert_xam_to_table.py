@@ -0,0 +1,73 @@
+#!/bin/python
+
+#------------------- Description & Notes --------------------#
+
+'''
+python convert_xam_to_table.py \
+    --xam ../../output/RNA-seq/alignments/ont_minimap2_sorted.bam \
+    --outputdir ../../output/RNA-seq/alignments/ont_minimap2_sorted.table \
+    --nshards 64 \
+    --nworkers 8
+'''
+
+## Converts a XAM file into a table of alignments (i.e., a directory of
+## Parquet files). The table can be used by estimate_alignment_accuracy.py
+## and identify_transcript_specific_reads.py (see --xamtable) instead of
+## the XAM file, so that repeated runs don't have to decode it again.
+
+#------------------- Dependencies ---------------------------#
+
+# Standard library imports
+
+# External imports
+
+# Internal imports
+from src import io
+from src.util import params
+
+#------------------- Constants ------------------------------#
+
+#------------------- Public Classes & Functions -------------#
+
+#------------------- Protected Classes & Functions ----------#
+
+#------------------- Private Classes & Functions ------------#
+
+def main():
+    ## **********
+    ## *** Parse command-line arguemnts
+    ## **********
+    argParser = params.ArgParser()
+    argParser.add_argument("--xam", help="SAM/BAM file",
+        nargs=1, type=argParser.isFile, required=True)
+    argParser.add_argument("--outputdir", help="Output table directory",
+        nargs=1, required=True)
+    argParser.add_argument("--nshards", help="Roughly how many parts \
+        the table is split into. Requires an indexed BAM file", nargs=1,
+        type=argParser.isGTZeroInt)
+    argParser.add_argument("--nworkers", help="Number of parts to \
+        write in parallel", nargs=1, type=argParser.isGTZeroInt, default=[1])
+    argParser.add_argument("--threads", help="Number of threads for \
+        decompressing BAM files", nargs=1, type=argParser.isGTZeroInt,
+        default=[1])
+    args = argParser.parse_args()
+
+    xamFile   = args.xam[0]
+    oDir      = args.outputdir[0]
+    numShards = args.nshards[0] if args.nshards is not None else None
+    nWorkers  = args.nworkers[0]
+    threads   = args.threads[0]
+
+    ## **********
+    ## *** Run - Convert the XAM file into a table
+    ## **********
+    tableParts = io.xam.toTable(xamFile, oDir, numShards=numShards,
+        nWorkers=nWorkers, threads=threads)
+    print("NUM PARTS:\t{}".format(len(tableParts)))
+
+#------------------- Main -----------------------------------#
+
+if (__name__ == "__main__"):
+    main()
+
+#------------------------------------------------------------------------------
@@ -5,48 +5,120 @@
 #------------------- Dependencies ---------------------------#
 
 # Standard library imports
+import functools
+import heapq
+import itertools
+import json
 import math
+import os
 import sys
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 
 # External imports
+import numpy as np
 import pandas as pd
-import pyspark.sql.functions as sparkF
-import pyspark.sql.types as sparkT
-from pyspark.sql import SparkSession
-from pyspark.sql import Row
+import pysam
 
 # Internal imports
 from src import xam
 from src import io
+from src import ops
 from src.util import params
-from src.util import spark
 
 #------------------- Constants ------------------------------#
 
+## Alignments that we don't use. These are skipped by the reader
+INVALID_FLAGS = pysam.FSECONDARY | pysam.FSUPPLEMENTARY | pysam.FUNMAP
+
+## Columns of the XAM table (see io.xam.toTable) that we need
+TABLE_COLS = ['query_name', 'query_length', 'cigar_ops', 'cigar_lens',
+    'md']
+
+## Number of reads that we process at once
+BATCH_SIZE = 100000
+
+## (Roughly) number of reads in each region (i.e., Spark partition)
+READS_PER_SHARD = 10000
+
+## Columns that we summarise, i.e., (min, max, mean, median) and mean
+SUMMARY_COLS = ['percentMapped', 'mismatchCount', 'avgMismatchLen',
+    'insertionCount', 'avgInsertionLen', 'deletionCount', 'avgDeletionLen']
+RATE_COLS    = ['matchRate', 'mismatchRate', 'insertionRate', 'deletionRate']
+
+## Relative error of medians
+REL_ERROR  = 0.0001
+
+## Sampling. The file is split into many small regions so that we can
+## skip most of it. For counts, we read OVERSAMPLE times as many reads as
+## we need (i.e., to account for the reads that we skip), and read more
+## regions until we have enough. Confidence intervals come from
+## NUM_BOOTSTRAPS replicates, resampling regions when at least
+## MIN_CLUSTERS regions were sampled
+SAMPLE_SHARDS  = 10000
+OVERSAMPLE     = 1.5
+MIN_CLUSTERS   = 30
+NUM_BOOTSTRAPS = 200
+CI_LEVEL       = 0.95
+
 #------------------- Public Classes & Functions -------------#
 
 #------------------- Private Classes & Functions ------------#
 
-def parseXamRec(xamRec):
-    name         = xamRec.query_name
-    isInvalid    = (xamRec.is_secondary or xamRec.is_supplementary or xamRec.is_unmapped)
-    query_length = xamRec.query_length
-    cigarString  = xamRec.cigarstring
-    mdTag        = xamRec.get_tag('MD')
-    return (name, isInvalid, query_length, cigarString, mdTag)
-
-def estimateAlignmentAccuracy(*xamInfo):
-    (name, isInvalid, query_length, cigarString, mdTag) = xamInfo
-    clipDict     = getClipCountDict(cigarString)
-    mutCountDict = getMutationCountDict(cigarString, mdTag)
-    rrLen        = query_length + clipDict['hardClipCount']
-    arLen        = rrLen - clipDict['totalClips']
-    perMap       = (arLen / rrLen) * 100
-    mutRateDict  = getMutationRateDict(mutCountDict, arLen)
-
-    aa = {'read_id':name, **clipDict, **mutCountDict, **mutRateDict,
-          'rawReadLength':rrLen, 'alignedReadLength':arLen,
-          'percentMapped':perMap}
+def estimateRegionAccuracy(regionDfs):
+    ## mapInPandas. Each row holds a region of the XAM file (see
+    ## io.xam.getRegions), and we return the accuracy metrics of its reads
+    ## in batches (see getAccuracySchema)
+    for regionDf in regionDfs:
+        for region in regionDf['region']:
+            xamRecs = io.xam.readRegion(tuple(json.loads(region)),
+                flagExclude=INVALID_FLAGS)
+            yield from getAccuracyBatches(xamRecs)
+
+def estimateTablePartAccuracy(tablePartDfs):
+    ## mapInPandas. Same as estimateRegionAccuracy, but each row holds
+    ## a part of the table (see io.xam.toTable)
+    for tablePartDf in tablePartDfs:
+        for tablePart in tablePartDf['tablePart']:
+            yield from getTableAccuracyBatches(tablePart)
+
+def getAccuracyBatches(xamRecs):
+    ## Reads are processed in batches
+    while True:
+        batch = list(itertools.islice(xamRecs, BATCH_SIZE))
+        if (len(batch) == 0):
+            break
+
+        (names, queryLengths, css, mdTags) = zip(*[(x.query_name,
+            x.query_length, x.cigarstring, x.get_tag('MD')) for x in batch])
+        aasDf = estimateAccuracyTable(names, np.array(queryLengths),
+            *xam.parseCigarStrings(css), mdTags)
+        yield aasDf
+
+def getTableAccuracyBatches(tablePart):
+    ## Same as getAccuracyBatches, but for the reads of a table part.
+    ## Only the columns we need are read
+    t = io.xam.readTable(tablePart, columns=TABLE_COLS,
+        flagExclude=INVALID_FLAGS)
+    for b in t.to_batches(max_chunksize=BATCH_SIZE):
+        aasDf = estimateAccuracyTable(b.column('query_name').to_pylist(),
+            b.column('query_length').to_numpy(), *io.xam.getTableCigars(b),
+            b.column('md').to_pylist())
+        yield aasDf
+
+def estimateAccuracyTable(names, queryLengths, cOps, cLens, cOffsets, mdTags):
+    ## Accuracy metrics of many alignments at once (i.e., from flattened
+    ## CIGARs). See getAccuracySchema for the columns of the table
+    statsDf = xam.cigarsToAlignmentStats(cOps, cLens, cOffsets, mdTags)
+    stats   = {c:statsDf[c].to_numpy() for c in statsDf.columns}
+    rrLen   = queryLengths + stats['hardClipCount']
+    arLen   = rrLen - stats['totalClips']
+    perMap  = (arLen / rrLen) * 100
+    mutRateDict = getMutationRateDict(stats, arLen)
+
+    aasDf   = pd.DataFrame({'read_id':list(names), **stats, **mutRateDict,
+        'rawReadLength':rrLen, 'alignedReadLength':arLen,
+        'percentMapped':perMap})
 
     ## To quantify the error rate of reads, we COULD also produce an error
     ## metric. For example, the 'total percent error', which refers to the
@@ -57,50 +129,59 @@ def estimateAlignmentAccuracy(*xamInfo):
     ##
     ## Important to note that we're NOT calculating this error metric as
     ## i'm not sure what will be the most intuitive way of presenting this.
-    return aa
-
-def getClipCountDict(cigarString):
-    sClipCount = xam.getSoftClipCount(cigarString)
-    hClipCount = xam.getHardClipCount(cigarString)
-    tClipCount = sClipCount + hClipCount
-    clipDict   = {'softClipCount':sClipCount, 'hardClipCount':hClipCount,
-                  'totalClips':tClipCount}
-    return clipDict
-
-def getMutationCountDict(cigarString, mdTag):
-    m        = xam.getMatches(mdTag)
-    mCount   = sum(m)
-    avgMLen  = 0 if mCount == 0 else (mCount / len(m))
-
-    ## Mismatches
-    mmBases  = xam.getMismatches(mdTag)
-    mm       = [len(x) for x in mmBases]
-    mmCount  = sum(mm)
-    minMmLen = 0 if mmCount == 0 else min(mm)
-    maxMmLen = 0 if mmCount == 0 else max(mm)
-    avgMmLen = 0 if mmCount == 0 else (mmCount / len(mm))
-
-    ## Insertions
-    i        = xam.getInsertions(cigarString)
-    iCount   = sum(i)
-    minILen  = 0 if iCount == 0 else min(i)
-    maxILen  = 0 if iCount == 0 else max(i)
-    avgILen  = 0 if iCount == 0 else (iCount / len(i))
-
-    ## Deletions
-    d        = xam.getDeletions(cigarString)
-    dCount   = sum(d)
-    minDLen  = 0 if dCount == 0 else min(d)
-    maxDLen  = 0 if dCount == 0 else max(d)
-    avgDLen  = 0 if dCount == 0 else (dCount / len(d))
-
-    mutCountDict = {'matchCount':mCount, 'mismatchCount':mmCount,
-        'insertionCount':iCount, 'deletionCount':dCount,
-        'minMismatchLen':minMmLen, 'maxMismatchLen':maxMmLen, 'avgMismatchLen':avgMmLen,
-        'minInsertionLen':minILen, 'maxInsertionLen':maxILen, 'avgInsertionLen':avgILen,
-        'minDeletionLen':minDLen, 'maxDeletionLen':maxDLen, 'avgDeletionLen':avgDLen}
-
-    return mutCountDict
+    return aasDf
+
+def getAccuracySchema():
+    ## Columns of the accuracy table (in order). Counts and lengths are
+    ## integers, and averages, rates and percentages are floats
+    import pyspark.sql.types as sparkT
+
+    isFloat  = lambda c: c.startswith('avg') or c.endswith('Rate') \
+        or c == 'percentMapped'
+    colNames = ['read_id'] + xam.STATS_COLS + ['matchRate', 'mismatchRate',
+        'insertionRate', 'deletionRate', 'rawReadLength',
+        'alignedReadLength', 'percentMapped']
+    colTypes = [sparkT.StringType()] \
+        + [sparkT.DoubleType() if isFloat(c) else sparkT.LongType()
+           for c in colNames[1:]]
+    cols     = [sparkT.StructField(c, t) for c, t in zip(colNames, colTypes)]
+    schema   = sparkT.StructType(cols)
+    return schema
+
+def summariseReads(xamRecs, relError):
+    ## Local backend. Summarise the accuracy of reads (i.e., of a region)
+    ## in batches, so that we never hold more than a batch of reads
+    summaries = newSummaries(relError)
+    for aasDf in getAccuracyBatches(xamRecs):
+        updateSummaries(summaries, aasDf)
+
+    return summaries
+
+def summariseTablePart(tablePart, relError):
+    ## Same as summariseReads, but for the reads of a table part
+    summaries = newSummaries(relError)
+    for aasDf in getTableAccuracyBatches(tablePart):
+        updateSummaries(summaries, aasDf)
+
+    return summaries
+
+def newSummaries(relError):
+    ## (Summary, QuantileSketch) of each column in SUMMARY_COLS and
+    ## Summary of each column in RATE_COLS. These can be merged
+    summaries = {c:(ops.Summary(), ops.QuantileSketch(relError))
+                 for c in SUMMARY_COLS}
+    summaries.update({c:(ops.Summary(), None) for c in RATE_COLS})
+    return summaries
+
+def updateSummaries(summaries, aasDf):
+    for c, (summary, sketch) in summaries.items():
+        summary.update(aasDf[c].to_numpy())
+        if (sketch is not None):
+            sketch.update(aasDf[c].to_numpy())
+
+def mergeSummaries(x, y):
+    f = lambda a, b: None if a is None else a.merge(b)
+    return {c:(f(x[c][0], y[c][0]), f(x[c][1], y[c][1])) for c in x}
 
 def getMutationRateDict(mutCountDict, arLen):
     mRate       = (mutCountDict['matchCount'] / arLen) * 100
@@ -111,38 +192,289 @@ def getMutationRateDict(mutCountDict, arLen):
                    'insertionRate':iRate, 'deletionRate':dRate}
     return mutRateDict
 
-def outputAlignmentAccuracy(aasDf, oFile, tDir):
-    ## Print the whole table out if required
+def outputAlignmentAccuracy(aasDf, oFile, tDir, relError=REL_ERROR):
+    import pyspark.sql.functions as sparkF
+    import pyspark.sql.types as sparkT
+
+    ## Print the whole table out if required. We'll need
+    ## the table again for the summary, so keep it around
     if (tDir is not None):
+        aasDf.persist()
         df = aasDf.coalesce(10)
         df.write.csv(tDir, mode='overwrite', sep='\t', header=True)
 
+    ## Summarise every column at once (i.e., in a single pass over the
+    ## table). Medians are approximate (within relError * N positions of
+    ## the exact median), which avoids sorting each column
+    accuracy = math.ceil(1 / relError)
+    aggs = []
+    for c in SUMMARY_COLS:
+        x = sparkF.col(c).cast(sparkT.DoubleType())
+        aggs += [sparkF.min(c), sparkF.max(c), sparkF.mean(c),
+                 sparkF.percentile_approx(x, 0.5, accuracy)]
+
+    aggs += [sparkF.mean(c) for c in RATE_COLS]
+    values = aasDf.agg(*aggs).collect()[0]
+
+    n = 4 * len(SUMMARY_COLS)
+    statsDict = {c:values[i:i + 4]
+                 for c, i in zip(SUMMARY_COLS, range(0, n, 4))}
+    ratesDict = dict(zip(RATE_COLS, values[n:]))
+    writeAlignmentAccuracy(oFile, statsDict, ratesDict)
+
+def summariseLocally(xamFile, xamTable, relError, nWorkers):
+    ## Each worker summarises a region of the XAM file (or a part of
+    ## the table) and we merge the summaries. There are more regions than
+    ## workers so that workers finish at (roughly) the same time
+    if (xamTable is not None):
+        tableParts = io.xam.getTableParts(xamTable)
+        f = functools.partial(summariseTablePart, relError=relError)
+        with ProcessPoolExecutor(max_workers=nWorkers) as executor:
+            summaries = list(executor.map(f, tableParts))
+
+    else:
+        regions   = io.xam.getRegions(*xamFile, numShards=nWorkers * 4)
+        f = functools.partial(summariseReads, relError=relError)
+        summaries = io.xam.mapRegions(f, regions, nWorkers,
+            flagExclude=INVALID_FLAGS)
+
+    return functools.reduce(mergeSummaries, summaries, newSummaries(relError))
+
+def sampleLocally(xamFile, xamTable, fraction, count, nWorkers, seed):
+    ## Sample reads of the XAM file (or table) and calculate their accuracy
+    ## metrics. Reads are sampled by fraction or count (i.e., reservoir
+    ## sampling, where we keep the reads with the smallest random keys)
+    seeds = np.random.SeedSequence(seed)
+    rng   = np.random.default_rng(seeds.spawn(1)[0])
+    if (xamTable is not None):
+        ## Tables are cheap to read, so we sample rows of every part
+        regions = io.xam.getTableParts(xamTable)
+        order   = np.arange(len(regions))
+        n       = len(regions)
+        rate    = fraction if fraction is not None else 1.0
+        f       = sampleTablePart
+
+    else:
+        ## Sample regions (i.e., with the index) so that we never read
+        ## the rest of the file. We need a rough sampling rate for counts
+        regions  = io.xam.getRegions(*xamFile, numShards=SAMPLE_SHARDS)
+        numReads = io.xam.getNumReads(*xamFile)
+        rate     = fraction if fraction is not None \
+            else 1.0 if numReads is None \
+            else min(OVERSAMPLE * count / max(numReads, 1), 1.0)
+        order    = np.arange(len(regions))
+        n        = len(regions)
+        if (len(regions) > 1):
+            order = rng.permutation(len(regions))
+            n     = max(round(rate * len(regions)), 1)
+            rate  = 1.0
+
+        f = sampleRegion
+
+    ## Each task is a cluster of reads (see getConfidenceIntervals).
+    ## Tasks can be small, so workers get several at a time
+    f        = functools.partial(f, rate=rate, count=count)
+    aasDfs   = []
+    numTasks = 0
+    with ProcessPoolExecutor(max_workers=nWorkers) as executor:
+        while (n > 0):
+            idx   = np.sort(order[numTasks:numTasks + n])
+            tasks = list(zip(range(numTasks, numTasks + len(idx)),
+                [regions[i] for i in idx], seeds.spawn(len(idx))))
+            c     = max(len(tasks) // (nWorkers * 4), 1)
+            aasDfs.extend(x for x in executor.map(f, tasks, chunksize=c)
+                if x is not None)
+            numTasks += len(tasks)
+
+            ## The index also counts reads that we skip, so we might not
+            ## have enough of them. If so, we sample more regions based on
+            ## the number of reads per region so far
+            numSampled = sum(len(x) for x in aasDfs)
+            if (count is None or numSampled >= count):
+                break
+
+            n = len(order) - numTasks if numSampled == 0 \
+                else math.ceil(OVERSAMPLE * (count - numSampled)
+                               * numTasks / numSampled)
+            n = min(n, len(order) - numTasks)
+
+    if (len(aasDfs) == 0):
+        raise ValueError('No reads were sampled.')
+
+    aasDf = pd.concat(aasDfs, ignore_index=True)
+    if (count is not None):
+        aasDf = aasDf.nsmallest(count, 'key')
+        if (len(aasDf) < count):
+            warnings.warn("Only {} of {} reads were sampled."
+                .format(len(aasDf), count))
+
+    print("NUM SAMPLED REGIONS:\t{}".format(numTasks))
+    print("NUM SAMPLED READS:\t{}".format(len(aasDf)))
+    return aasDf
+
+def sampleRegion(task, rate, count):
+    (clusterId, region, seed) = task
+    rng     = np.random.default_rng(seed)
+    xamRecs = io.xam.readRegion(region, flagExclude=INVALID_FLAGS)
+    if (rate < 1):
+        xamRecs = (x for x in xamRecs if rng.random() < rate)
+
+    ## Keep the reads with the smallest keys
+    keys = None
+    if (count is not None):
+        heap = []
+        for i, x in enumerate(xamRecs):
+            k = rng.random()
+            if (len(heap) < count):
+                heapq.heappush(heap, (-k, i, x))
+
+            elif (-heap[0][0] > k):
+                heapq.heapreplace(heap, (-k, i, x))
+
+        heap    = sorted(heap, key=lambda x: x[1])
+        keys    = [-x[0] for x in heap]
+        xamRecs = iter([x[2] for x in heap])
+
+    aasDfs = list(getAccuracyBatches(xamRecs))
+    return _toSample(aasDfs, clusterId, keys, rng)
+
+def sampleTablePart(task, rate, count):
+    ## Same as sampleRegion, but rows are sampled before we calculate
+    ## their accuracy metrics
+    (clusterId, tablePart, seed) = task
+    rng  = np.random.default_rng(seed)
+    t    = io.xam.readTable(tablePart, columns=TABLE_COLS,
+        flagExclude=INVALID_FLAGS)
+    keys = rng.random(t.num_rows)
+    isSampled = (keys < rate)
+    if (count is not None):
+        isSampled[np.argsort(keys, kind='stable')[count:]] = False
+
+    t    = t.filter(isSampled)
+    keys = keys[isSampled].tolist() if count is not None else None
+    aasDfs = [estimateAccuracyTable(b.column('query_name').to_pylist(),
+              b.column('query_length').to_numpy(), *io.xam.getTableCigars(b),
+              b.column('md').to_pylist())
+              for b in t.to_batches(max_chunksize=BATCH_SIZE)]
+    return _toSample(aasDfs, clusterId, keys, rng)
+
+def getConfidenceIntervals(aasDf, seed):
+
+    """
+    Description:
+        (min, max, mean, median) of each column in SUMMARY_COLS and the
+        mean of each column in RATE_COLS, with bootstrap confidence
+        intervals of means and medians. Replicates can't go beyond the
+        min (or max) of the sample, so those don't get intervals. Reads of
+        the same region aren't independent, so we resample regions (i.e.,
+        clusters) rather than reads when there are enough of them. Each
+        replicate weighs every cluster by a Poisson(1) count (i.e., a
+        Poisson bootstrap)
+
+    Args:
+        aasDf (pd.DataFrame)
+            Accuracy metrics of the sampled reads, and the cluster of each
+            read
+        seed (int)
+            Seed of the random number generator
+
+    Returns:
+        (statsDict, ratesDict, ciDict) (dict)
+            Estimates (see writeAlignmentAccuracy), and the (lower, upper)
+            bounds of each mean (and median)
+    """
+
+    rng = np.random.default_rng(seed)
+    (codes, uniques) = pd.factorize(aasDf['cluster'])
+    if (len(uniques) < MIN_CLUSTERS):
+        codes = np.arange(len(aasDf))
+
+    numClusters = codes.max() + 1
+    cols   = SUMMARY_COLS + RATE_COLS
+    values = {c:aasDf[c].to_numpy() for c in cols}
+    order  = {c:np.argsort(values[c], kind='stable') for c in SUMMARY_COLS}
+    f = lambda w: {c:_getWeightedStats(values[c], order.get(c), w)
+                   for c in cols}
+
+    ## Estimates are the statistics of the sample itself
+    estimates = f(np.ones(len(aasDf), dtype=np.int64))
+    reps = []
+    for _ in range(NUM_BOOTSTRAPS):
+        w = rng.poisson(1, numClusters)[codes]
+        if (w.sum() != 0):
+            reps.append(f(w))
+
+    ## We only have the mean of each column in RATE_COLS
+    ciDict = {}
+    q = [(1 - CI_LEVEL) / 2, (1 + CI_LEVEL) / 2]
+    for c in cols:
+        idx = [2, 3] if c in SUMMARY_COLS else [2]
+        x   = np.array([[r[c][i] for i in idx] for r in reps],
+            dtype=np.float64)
+        (lo, hi)  = np.quantile(x, q, axis=0)
+        ciDict[c] = list(zip(lo.tolist(), hi.tolist()))
+
+    statsDict = {c:estimates[c] for c in SUMMARY_COLS}
+    ratesDict = {c:estimates[c][2] for c in RATE_COLS}
+    ciDict.update({c:ciDict[c][0] for c in RATE_COLS})
+    return (statsDict, ratesDict, ciDict)
+
+def outputSummaries(summaries, oFile):
+    ## Local backend. Same as outputAlignmentAccuracy
+    statsDict = {}
+    for c in SUMMARY_COLS:
+        (summary, sketch) = summaries[c]
+        statsDict[c] = (summary.min, summary.max, summary.mean,
+            sketch.quantile(0.5))
+
+    ratesDict = {c:summaries[c][0].mean for c in RATE_COLS}
+    writeAlignmentAccuracy(oFile, statsDict, ratesDict)
+
+def writeAlignmentAccuracy(oFile, statsDict, ratesDict, ciDict=None):
+    ## statsDict holds the (min, max, mean, median) of each column
+    ## in SUMMARY_COLS and ratesDict the mean of each column in RATE_COLS.
+    ## Confidence intervals (i.e., for samples) are written after each mean
+    ## and median
+    ci = lambda c, i: "" if ciDict is None \
+        else "\t{}\t{}".format(*(ciDict[c][i] if i is not None else ciDict[c]))
+
     with open(oFile, "w") as f:
         ## Part 1
-        cols = ['percentMapped',
-                'mismatchCount', 'avgMismatchLen',
-                'insertionCount', 'avgInsertionLen',
-                'deletionCount', 'avgDeletionLen']
-
-        for c in cols:
-            df = aasDf.select(
-                    sparkF.min(c).alias("Min"),
-                    sparkF.max(c).alias("Max"),
-                    sparkF.mean(c).alias("Mean"))
-            (minV, maxV, meanV) = df.collect()[0]
-            medianV = aasDf.approxQuantile(c, [0.5], 0)[0]
-
+        for c in SUMMARY_COLS:
+            (minV, maxV, meanV, medianV) = statsDict[c]
             f.write("Min {}\t{}\n".format(c, minV))
             f.write("Max {}\t{}\n".format(c, maxV))
-            f.write("Mean {}\t{}\n".format(c, meanV))
-            f.write("Median {}\t{}\n\n".format(c, medianV))
+            f.write("Mean {}\t{}{}\n".format(c, meanV, ci(c, 0)))
+            f.write("Median {}\t{}{}\n\n".format(c, medianV, ci(c, 1)))
 
         ## Part 2
-        cols = ['matchRate', 'mismatchRate', 'insertionRate', 'deletionRate']
-        for c in cols:
-            df    = aasDf.select(sparkF.mean(c).alias("Mean"))
-            meanV = df.collect()[0][0]
-            f.write("Mean {}\t{}\n".format(c, meanV))
+        for c in RATE_COLS:
+            f.write("Mean {}\t{}{}\n".format(c, ratesDict[c], ci(c, None)))
+
+def _toSample(aasDfs, clusterId, keys, rng):
+    if (len(aasDfs) == 0):
+        return None
+
+    aasDf = pd.concat(aasDfs, ignore_index=True)
+    aasDf['cluster'] = clusterId
+    aasDf['key']     = keys if keys is not None else rng.random(len(aasDf))
+    return aasDf
+
+def _getWeightedStats(x, order, w):
+    ## (min, max, mean, median) of values weighed by w. Medians are the
+    ## smallest value whose (weighted) rank is >= 0.5 * the total weight.
+    ## We only need the mean when we don't have the order of the values
+    total = w.sum()
+    meanV = float((x * w).sum() / total)
+    if (order is None):
+        return (None, None, meanV, None)
+
+    hasWeight = (w != 0)
+    minV    = x[hasWeight].min().item()
+    maxV    = x[hasWeight].max().item()
+    ranks   = np.cumsum(w[order])
+    medianV = float(x[order[np.searchsorted(ranks, 0.5 * total)]])
+    return (minV, maxV, meanV, medianV)
 
 def main():
     ## **********
@@ -150,39 +482,104 @@ def main():
     ## **********
     argParser = params.ArgParser()
     argParser.add_argument("--xam", help="SAM/BAM file",
-        nargs=1, type=argParser.isFile, required=True)
+        nargs=1, type=argParser.isFile)
+    argParser.add_argument("--xamtable", help="Table of alignments \
+        (see convert_xam_to_table.py). Used instead of the SAM/BAM file",
+        nargs=1, type=argParser.isDir)
     argParser.add_argument("--outputfile", help="Output file",
         nargs=1, required=True)
     argParser.add_argument("--tabledir", help="Directory containing numericals",
         nargs=1)
+    argParser.add_argument("--relerror", help="Relative error of medians \
+        (0-1). Lower is more accurate but slower", nargs=1,
+        type=argParser.isNumeric, default=[REL_ERROR])
+    argParser.add_argument("--backend", help="[Spark] or [Local]. The local \
+        backend streams reads with a pool of processes instead of starting \
+        a Spark session", nargs=1, default=['SPARK'])
+    argParser.add_argument("--nworkers", help="Number of processes of \
+        the local backend. By default, all cores", nargs=1,
+        type=argParser.isGTZeroInt, default=[os.cpu_count()])
+    argParser.add_argument("--sample", help="Only use a sample of reads. \
+        Either a fraction (< 1) or a number of reads. Means and medians \
+        come with a {:.0%} confidence interval. Requires the local backend"
+        .format(CI_LEVEL), nargs=1, type=argParser.isNumeric)
+    argParser.add_argument("--seed", help="Seed for sampling reads",
+        nargs=1, type=argParser.isGTZeroInt)
     args = argParser.parse_args()
 
-    xamFile = args.xam
-    oFile   = args.outputfile[0]
-    tDir    = args.tabledir[0] if args.tabledir is not None else None
+    xamFile  = args.xam
+    xamTable = args.xamtable[0] if args.xamtable is not None else None
+    oFile    = args.outputfile[0]
+    tDir     = args.tabledir[0] if args.tabledir is not None else None
+    relError = args.relerror[0]
+    backend  = args.backend[0].upper()
+    nWorkers = args.nworkers[0]
+    sample   = args.sample[0] if args.sample is not None else None
+    seed     = args.seed[0] if args.seed is not None else None
+    fraction = sample if sample is not None and sample < 1 else None
+    count    = int(sample) if sample is not None and sample >= 1 else None
+    if ((xamFile is None) == (xamTable is None)):
+        raise ValueError('Must have either a SAM/BAM file or a table.')
+
+    if (relError <= 0 or relError >= 1):
+        raise ValueError('Relative error must be between 0 and 1.')
+
+    if (backend != 'SPARK' and backend != 'LOCAL'):
+        raise ValueError('Invalid option.')
+
+    if (backend == 'LOCAL' and tDir is not None):
+        raise ValueError('Tables of numericals require the Spark backend.')
+
+    if (sample is not None and (sample <= 0 or (count is not None
+        and count != sample))):
+        raise ValueError('Sample must be a fraction or a number of reads.')
+
+    if (sample is not None and backend != 'LOCAL'):
+        raise ValueError('Sampling requires the local backend.')
 
     ## **********
     ## *** Run - Estimate the overall accuracy of an alignment file
     ## **********
+    if (sample is not None):
+        aasDf = sampleLocally(xamFile, xamTable, fraction, count, nWorkers,
+            seed)
+        (statsDict, ratesDict, ciDict) = getConfidenceIntervals(aasDf, seed)
+        writeAlignmentAccuracy(oFile, statsDict, ratesDict, ciDict)
+        return
+
+    if (backend == 'LOCAL'):
+        summaries = summariseLocally(xamFile, xamTable, relError, nWorkers)
+        outputSummaries(summaries, oFile)
+        return
+
+    ## Only the Spark backend needs Spark
+    from src.util import spark
     with spark.getSparkSession() as ss:
         with ss.sparkContext as sc:
-            ## Read XAM files
-            xamRdd = sc.parallelize(xamFile)
-            xamRdd = xamRdd.flatMap(io.xam.read).map(parseXamRec) \
-                           .filter(lambda x: not x[1])
-
-            ## Repartition. Supposedly improves efficiency
-            nParts = math.floor(xamRdd.count() / 10000)
-            nParts = max(sc.defaultParallelism, nParts)
-            print("NUM PARTITIONS:\t{}".format(nParts))
-            xamRdd = xamRdd.repartition(nParts)
-
-            ## Calculate accuracy metrics for each alignment
-            aasDf =  xamRdd.map(lambda x: estimateAlignmentAccuracy(*x)) \
-                           .map(lambda x: Row(**x)).toDF()
+            ## Each task reads a region of the XAM file (or a part of the
+            ## table) and calculates accuracy metrics for its reads in
+            ## batches. Regions are sized from the index statistics so that
+            ## each has roughly READS_PER_SHARD reads
+            if (xamTable is not None):
+                tableParts = io.xam.getTableParts(xamTable)
+                rows = [(p,) for p in tableParts]
+                (f, cols) = (estimateTablePartAccuracy, 'tablePart string')
+
+            else:
+                numReads  = io.xam.getNumReads(*xamFile)
+                numShards = sc.defaultParallelism if numReads is None \
+                    else math.ceil(numReads / READS_PER_SHARD)
+                numShards = max(sc.defaultParallelism, numShards)
+                regions   = io.xam.getRegions(*xamFile, numShards=numShards)
+                rows = [(json.dumps(r),) for r in regions]
+                (f, cols) = (estimateRegionAccuracy, 'region string')
+
+            print("NUM PARTITIONS:\t{}".format(len(rows)))
+            tasksDf = ss.createDataFrame(sc.parallelize(rows, len(rows)), cols)
+            aasDf   = tasksDf.mapInPandas(f, schema=getAccuracySchema())
 
             ## Summarise accuracy for the whole dataset
-            outputAlignmentAccuracy(aasDf, oFile, tDir)
+            outputAlignmentAccuracy(aasDf, oFile, tDir, relError)
 
 #------------------- Main -----------------------------------#
 
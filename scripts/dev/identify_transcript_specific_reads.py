@@ -8,7 +8,9 @@
 import itertools
 
 # External imports
+import numpy as np
 import pandas as pd
+import pysam
 import pyspark.sql.functions as sparkF
 import pyspark.sql.types as sparkT
 from pyspark.sql import SparkSession
@@ -23,6 +25,19 @@ from src.util import spark
 
 #------------------- Constants ------------------------------#
 
+GXF_ATTRS    = ['transcript_id', 'gene_id']
+GXF_FEATURES = ['transcript', 'exon']
+
+## Number of reads that we process at once
+BATCH_SIZE   = 100000
+
+## Alignments that we don't use. These are skipped by the reader
+INVALID_FLAGS = pysam.FUNMAP
+
+## Columns of the XAM table (see io.xam.toTable) that we need
+TABLE_COLS   = ['query_name', 'flag', 'contig', 'pos', 'cigar_ops',
+    'cigar_lens']
+
 #------------------- Public Classes & Functions -------------#
 
 #------------------- Protected Classes & Functions ----------#
@@ -35,69 +50,66 @@ def parseXamRec(xamRec):
     strand      = '-' if xamRec.is_reverse else '+'
     ref_name    = xamRec.reference_name
     ref_pos     = xamRec.reference_start + 1
-    cigarTuples = xamRec.cigartuples
-    return ((query_name, readId, ref_name, strand), (ref_pos, cigarTuples))
+    cigarString = xamRec.cigarstring
+    return ((query_name, readId, ref_name, strand), (ref_pos, cigarString))
 
-def getXamDf(xamRdd):
-    ss = SparkSession.getActiveSession()
-    if (ss is None):
-        raise EnvironmentError("Must have an active Spark session")
-
-    ## We're unable to repartition before mapping
-    sc     = ss.sparkContext
-    xamRdd = xamRdd.repartition(sc.defaultParallelism)
+def getXamRdd(xamRdd):
+    ## Reads are already spread across partitions (i.e., regions of
+    ## the XAM files), so there's no need to repartition
 
     ## Convert the cigar string into genomic coordinates
     ## so that we can get the position of exons and exon-exon junctions
-    f = lambda x: xam.cigartuplesToGenomicCoordinates(x[0], x[1])
-    g = lambda x: (x, ops.exonStrListToJunctionStrList(x))
-    xamRdd = xamRdd.mapValues(f).mapValues(g)
+    xamRdd = xamRdd.mapPartitions(getGenomicCoordinates)
+    return xamRdd
+
+def getGenomicCoordinates(xamRecs):
+    ## Convert reads in batches. For each read, returns
+    ## (query_name, readId, ref_name, strand,
+    ##  rStart, rEnd, exon_list, junction_list)
+    while True:
+        batch = list(itertools.islice(xamRecs, BATCH_SIZE))
+        if (len(batch) == 0):
+            break
+
+        (keys, values)   = zip(*batch)
+        (refStarts, css) = zip(*values)
+        (cOps, cLens, cOffsets) = xam.parseCigarStrings(css)
+        yield from toGenomicCoordinates(keys, refStarts,
+            cOps, cLens, cOffsets)
+
+def getTableCoordinates(tablePart, region):
+    ## Same as parseXamRec and getGenomicCoordinates, but for the reads
+    ## of a table part (see io.xam.toTable). Reads are processed in batches
+    ## and only the columns we need are read
+    t = io.xam.readTable(tablePart, columns=TABLE_COLS, region=region,
+        flagExclude=INVALID_FLAGS)
+    for b in t.to_batches(max_chunksize=BATCH_SIZE):
+        flags    = b.column('flag').to_numpy()
+        readIds  = np.where(flags & pysam.FREAD1, 1, 2).tolist()
+        strands  = np.where(flags & pysam.FREVERSE, '-', '+').tolist()
+        keys     = zip(b.column('query_name').to_pylist(), readIds,
+            b.column('contig').to_pylist(), strands)
+        (cOps, cLens, cOffsets) = io.xam.getTableCigars(b)
+        yield from toGenomicCoordinates(list(keys),
+            b.column('pos').to_numpy(), cOps, cLens, cOffsets)
+
+def toGenomicCoordinates(keys, refStarts, cOps, cLens, cOffsets):
+    (eStarts, eEnds, eOffsets) = xam.cigarsToGenomicCoordinates(
+        refStarts, cOps, cLens, cOffsets)
+    (jStarts, jEnds, jOffsets) = xam.blocksToJunctions(
+        eStarts, eEnds, eOffsets)
 
     ## Get the start and end coordinates of the read
-    f = lambda x: (int(ops.getStart(x[0])), int(ops.getEnd(x[0])), *x)
-    g = lambda x: (*x[0], *x[1])
-    xamRdd = xamRdd.mapValues(f).map(g)
-
-    ## Construct the schema for the Spark DataFrame
-    colNames = ['query_name', 'readId', 'ref_name', 'strand',
-                'rStart', 'rEnd', 'exon_list', 'junction_list']
-    colTypes = [sparkT.StringType(), sparkT.IntegerType(),
-                sparkT.StringType(), sparkT.StringType(),
-                sparkT.IntegerType(), sparkT.IntegerType(),
-                sparkT.ArrayType(sparkT.StringType()),
-                sparkT.ArrayType(sparkT.StringType())]
-    cols     = [sparkT.StructField(c, t) for c, t in zip(colNames, colTypes)]
-    schema   = sparkT.StructType(cols)
-
-    ## Construct a Spark DataFrame of XAM records
-    xamDf    = ss.createDataFrame(xamRdd, schema)
-    return xamDf
-
-def getGxfDf(gtDf):
-    ss = SparkSession.getActiveSession()
-    if (ss is None):
-        raise EnvironmentError("Must have an active Spark session")
-
-    ## Construct the schema for the Spark DataFrame
-    colNames = ['gene_id', 'transcript_id',
-                'tStart', 'tEnd', 'seqname', 'strand',
-                'exon_list', 'junction_list']
-
-    colTypes = [sparkT.StringType(), sparkT.StringType(),
-                sparkT.IntegerType(), sparkT.IntegerType(),
-                sparkT.StringType(), sparkT.StringType(),
-                sparkT.ArrayType(sparkT.StringType()),
-                sparkT.ArrayType(sparkT.StringType())]
-    cols     = [sparkT.StructField(c, t) for c, t in zip(colNames, colTypes)]
-    schema   = sparkT.StructType(cols)
-
-    ## Construct a Spark DataFrame of XAM records
-    gtDf     = ss.createDataFrame(gtDf, schema)
-    return gtDf
-
-def identifyUniqueTranscripts(xamDf, gtDf, ssFlag):
+    rStarts = eStarts[eOffsets[:-1]].tolist()
+    rEnds   = eEnds[eOffsets[1:] - 1].tolist()
+    rexss   = xam.blocksToTuples(eStarts, eEnds, eOffsets)
+    rjunss  = xam.blocksToTuples(jStarts, jEnds, jOffsets)
+    for x in zip(keys, rStarts, rEnds, rexss, rjunss):
+        yield (*x[0], *x[1:])
+
+def identifyUniqueTranscripts(xamRdd, gtDf, ssFlag):
     ## Find transcripts that overlap with each read
-    tDf = identifyTranscripts(xamDf, gtDf, ssFlag)
+    tDf = identifyTranscripts(xamRdd, gtDf, ssFlag)
 
     ## Find transcript-specific reads
     tsrDf = identifyTranscriptSpecificReads(tDf)
@@ -108,29 +120,59 @@ def identifyUniqueTranscripts(xamDf, gtDf, ssFlag):
             .sort(df.transcript_id, df.query_name, df.readId)
     return df
 
-def identifyTranscripts(xamDf, gtDf, ssFlag):
-    cond = [xamDf.ref_name == gtDf.seqname,
-            xamDf.rStart >= gtDf.tStart, xamDf.rEnd <= gtDf.tEnd]
-
-    if (ssFlag):
-        ssCond = (xamDf.strand == gtDf.strand)
-        cond.append(ssCond)
+def identifyTranscripts(xamRdd, gtDf, ssFlag):
+    ss = SparkSession.getActiveSession()
+    if (ss is None):
+        raise EnvironmentError("Must have an active Spark session")
 
-    tDf  = xamDf.join(gtDf, cond, 'inner')
+    ## Rather than joining every read with every transcript, we index
+    ## the transcripts and send the index to each worker. Transcripts
+    ## are small enough to be broadcasted. Transcripts without exons
+    ## can't be aligned with reads, so we ignore them
+    cond  = gtDf['exon_list'].map(lambda x: isinstance(x, tuple))
+    gtDf  = gtDf[cond].reset_index(drop=True)
+    strands = gtDf['strand'] if ssFlag else None
+    idx     = ops.IntervalIndex(gtDf['seqname'], gtDf['start'], gtDf['end'],
+        strands)
+    cols    = ['gene_id', 'transcript_id', 'exon_list', 'junction_list']
+    gtRecs  = gtDf[cols].to_records(index=False)
+    gtBc    = ss.sparkContext.broadcast((idx, gtRecs))
+
+    ## Find transcripts that contain each read, and check whether the
+    ## genomic coordinates of the read matches with the genomic
+    ## coordinates of the transcript. If there's a match, then we have
+    ## 'some evidence' for the transcript. We still need to check whether
+    ## the read uniquely maps to the transcript
+    f     = lambda x: findTranscripts(x, *gtBc.value, ssFlag)
+    tRdd  = xamRdd.mapPartitions(f)
 
-    ## Check whether the genomic coordinates of the read
-    ## matches with the genomic coordinates of the transcript
-    tDf  = tDf.withColumn('isAligned',
-        hasReadAlignment(xamDf.exon_list, xamDf.junction_list,
-            gtDf.exon_list, gtDf.junction_list))
+    ## Construct the schema for the Spark DataFrame
+    colNames = ['query_name', 'readId', 'gene_id', 'transcript_id']
+    colTypes = [sparkT.StringType(), sparkT.IntegerType(),
+                sparkT.StringType(), sparkT.StringType()]
+    cols     = [sparkT.StructField(c, t) for c, t in zip(colNames, colTypes)]
+    schema   = sparkT.StructType(cols)
 
-    ## If there's a match, then we have 'some evidence' for the transcript
-    ## We still need to check whether the read uniquely maps to the transcript
-    tDf  = tDf.select(xamDf.query_name, xamDf.readId,
-        gtDf.gene_id, gtDf.transcript_id, 'isAligned')
-    tDf  = tDf.filter(tDf.isAligned == True)
+    tDf  = ss.createDataFrame(tRdd, schema)
+    tDf.persist()
     return tDf
 
+def findTranscripts(xamRecs, idx, gtRecs, ssFlag):
+    ## Query the index with batches of reads
+    while True:
+        batch = list(itertools.islice(xamRecs, BATCH_SIZE))
+        if (len(batch) == 0):
+            break
+
+        (query_names, readIds, ref_names, strands,
+         rStarts, rEnds, rexss, rjunss) = zip(*batch)
+        strands = strands if ssFlag else None
+        (qIdxs, tIdxs) = idx.contains(ref_names, rStarts, rEnds, strands)
+        for q, t in zip(qIdxs, tIdxs):
+            (gene_id, transcript_id, texs, tjuns) = gtRecs[t]
+            if (hasReadAlignment(rexss[q], rjunss[q], texs, tjuns)):
+                yield (query_names[q], readIds[q], gene_id, transcript_id)
+
 def identifyTranscriptSpecificReads(tDf):
     ## Find reads that are transcript-specific
     ## Reads are considered transcript-specific if it overlaps with exactly
@@ -152,22 +194,18 @@ def identifyTranscriptSpecificReads(tDf):
     tsrDf = tsrDf.filter((tsrDf.gene_count == 1) & (tsrDf.transcript_count == 1))
     return tsrDf
 
-@sparkF.udf(returnType=sparkT.BooleanType())
-def hasReadAlignment(rexStrList, rjunStrList, texStrList, tjunStrList):
-    (rStart, rEnd) = (ops.getStart(rexStrList), ops.getEnd(rexStrList))
-    (tStart, tEnd) = (ops.getStart(texStrList), ops.getEnd(texStrList))
+def hasReadAlignment(rexs, rjuns, texs, tjuns):
+    (rStart, rEnd) = (ops.getStart(rexs), ops.getEnd(rexs))
+    (tStart, tEnd) = (ops.getStart(texs), ops.getEnd(texs))
 
     ## Check whether the read is smaller than the transcript
     if (hasOverlap((rStart, rEnd), (tStart, tEnd))):
-        rexs = [ops.exonStrToTuple(rEx) for rEx in rexStrList]
-        texs = [ops.exonStrToTuple(tEx) for tEx in texStrList]
-
         ## Check whether every 'exon' and 'junction' of the read
         ## aligns with the transcript.
         eOverlaps = [any(hasOverlap(rEx, tEx) for tEx in texs)
                      for rEx in rexs]
-        jOverlaps = [any((rJun == tJun) for tJun in tjunStrList)
-                     for rJun in rjunStrList]
+        jOverlaps = [any((rJun == tJun) for tJun in tjuns)
+                     for rJun in rjuns]
         overlaps  = itertools.chain(eOverlaps, jOverlaps)
         if (all(list(overlaps))):
             return True
@@ -188,46 +226,64 @@ def main():
     argParser.add_argument("--gxf", help="GTF file",
         nargs=1, type=argParser.isFile, required=True)
     argParser.add_argument("--xam", help="SAM/BAM file",
-        nargs='+', type=argParser.isFile, required=True)
+        nargs='+', type=argParser.isFile)
+    argParser.add_argument("--xamtable", help="Table of alignments \
+        (see convert_xam_to_table.py). Used instead of the SAM/BAM file",
+        nargs='+', type=argParser.isDir)
     argParser.add_argument("--outputfile", help="Output file",
         nargs=1, required=True)
     argParser.add_argument("--ss", help="Reads must match strand of transcript. \
         Mainly for ONT Direct RNA-seq reads", action='store_true')
+    argParser.add_argument("--region", help="Only use transcripts and reads \
+        within a region (i.e., chr1:1-5000000). Requires indexed XAM files",
+        nargs=1)
     args = argParser.parse_args()
 
-    gxfFile  = args.gxf
-    xamFiles = args.xam
-    oFile    = args.outputfile[0]
-    ssFlag   = args.ss
+    gxfFile   = args.gxf
+    xamFiles  = args.xam
+    xamTables = args.xamtable
+    oFile     = args.outputfile[0]
+    ssFlag    = args.ss
+    region    = args.region[0] if args.region is not None else None
+    if ((xamFiles is None) == (xamTables is None)):
+        raise ValueError('Must have either SAM/BAM files or tables.')
 
     ## **********
     ## *** Run - Unambigous identification of transcripts from RNA-seq reads
     ## **********
-    gxfDf = list(io.gxf.read(*gxfFile))[0]
+    gxfDf = list(io.gxf.read(*gxfFile, attrs=GXF_ATTRS,
+        features=GXF_FEATURES, region=region))[0]
     tDf   = gxf.getTranscripts(gxfDf)
     gtDf  = gxf.getGeneTranscriptPairs(gxfDf)
     gtDf  = gtDf.merge(tDf, on='transcript_id', how='left')
-    gtDf['exon_list']     = gtDf['exon_list'].str.split(',')
-    gtDf['junction_list'] = gtDf['exon_list'].apply(ops.exonStrListToJunctionStrList)
+    gtDf['junction_list'] = gtDf['exon_list'].apply(ops.exonsToJunctions)
 
     with spark.getSparkSession() as ss:
         with ss.sparkContext as sc:
-            ## Read XAM files
-            xamRdd = sc.parallelize(xamFiles)
-            xamRdd = xamRdd.flatMap(io.xam.read).map(parseXamRec)
-
-            ## Construct Spark XAM DataFrame
-            xamDf  = getXamDf(xamRdd)
-            xamDf.persist()
-
-            ## Construct Spark GXF DataFrame
-            gtDf   = getGxfDf(gtDf)
-            gtDf.persist()
+            if (xamTables is not None):
+                ## Read the tables. Each task reads a part of a table
+                ## and gets the genomic coordinates of reads
+                tableParts = [p for t in xamTables
+                              for p in io.xam.getTableParts(t)]
+                xamRdd = sc.parallelize(tableParts, len(tableParts))
+                xamRdd = xamRdd.flatMap(
+                    lambda x: getTableCoordinates(x, region))
+
+            else:
+                ## Read XAM files. Each task reads a region of a file
+                regions = [r for f in xamFiles for r in io.xam.getRegions(f,
+                           region=region, numShards=sc.defaultParallelism)]
+                xamRdd = sc.parallelize(regions, len(regions))
+                xamRdd = xamRdd.flatMap(lambda x: io.xam.readRegion(x,
+                    flagExclude=INVALID_FLAGS)).map(parseXamRec)
+
+                ## Get the genomic coordinates of reads
+                xamRdd = getXamRdd(xamRdd)
 
             ## Uniquely identify transcripts.
             ## For unambiguous identification, transcripts must
             ## have at least 1 distinct read.
-            tsrDf  = identifyUniqueTranscripts(xamDf, gtDf, ssFlag)
+            tsrDf  = identifyUniqueTranscripts(xamRdd, gtDf, ssFlag)
             tsrDf  = tsrDf.coalesce(1)
             tsrDf.write.csv(oFile, mode='overwrite', sep='\t', header=True)
 
@@ -9,6 +9,7 @@
 # External imports
 
 # Internal imports
+from .common import formatExons
 from .common import getExons
 from .common import getTranscripts
 from .common import getGeneTranscriptPairs
@@ -16,6 +17,8 @@ from .common import getGeneTranscriptPairs
 from .transcript import dropDuplicates
 from .transcript import explodeDuplicates
 from .transcript import getASTranscripts
+from .transcript import getStructureKeys
+from .transcript import joinStructures
 from .transcript import removeSingleTranscriptGenes
 
 #------------------- Constants ------------------------------#
@@ -7,9 +7,12 @@
 # Standard library imports
 
 # External imports
+import numpy as np
+import pandas as pd
 
 # Internal imports
-from ..ops import sortExonStrList
+from ..ops import exonsToStr
+from ..ops import junctionsToStr
 
 #------------------- Constants ------------------------------#
 
@@ -17,18 +20,32 @@ from ..ops import sortExonStrList
 
 def getExons(gtfDf):
     ## Get all exons
-    cond = (gtfDf['feature'] == 'exon')
-    eDf  = gtfDf[cond][['start', 'end', 'transcript_id']]
-    eDf['start_end'] = '(' + eDf['start'].astype(str) \
-                           + '-' + eDf['end'].astype(str) + ')'
-    f = lambda x: ','.join(set(x))
-    eDf = eDf.groupby(['transcript_id'])['start_end'].apply(f)
-    eDf = eDf.reset_index()
-    eDf = eDf.rename(columns={'start_end':'exon_list'})
-
-    ## Sort exons by genomic coordinates
-    f = lambda x: ','.join(sortExonStrList(x.split(',')))
-    eDf['exon_list'] = eDf['exon_list'].apply(f)
+    cond = (gtfDf['feature'] == 'exon').to_numpy()
+    eDf  = gtfDf[['transcript_id', 'start', 'end']][cond]
+
+    ## Sort exons by transcript and genomic coordinates. Sorting integer
+    ## codes is much quicker than sorting the IDs themselves
+    (codes, tIds) = pd.factorize(eDf['transcript_id'], sort=True)
+    starts = eDf['start'].to_numpy()
+    ends   = eDf['end'].to_numpy()
+    idx    = np.lexsort((ends, starts, codes))
+    idx    = idx[codes[idx] != -1]
+    (codes, starts, ends) = (codes[idx], starts[idx], ends[idx])
+
+    ## Remove duplicate exons
+    isNew  = np.ones(len(codes), dtype=bool)
+    isNew[1:] = ((codes[1:] != codes[:-1]) | (starts[1:] != starts[:-1])
+                 | (ends[1:] != ends[:-1]))
+    (codes, starts, ends) = (codes[isNew], starts[isNew], ends[isNew])
+
+    ## The exons of each transcript are now next to each other
+    ## so we only need to find where each transcript begins and ends
+    offs  = np.flatnonzero(np.diff(codes, prepend=-1))
+    offs  = np.append(offs, len(codes)).tolist()
+    exons = list(zip(starts.tolist(), ends.tolist()))
+    exons = [tuple(exons[s:e]) for s, e in zip(offs[:-1], offs[1:])]
+    eDf   = pd.DataFrame({'transcript_id':tIds[codes[offs[:-1]]],
+        'exon_list':exons})
     return eDf
 
 def getTranscripts(gtfDf):
@@ -48,6 +65,21 @@ def getGeneTranscriptPairs(gtfDf):
     gtDf = gtDf.drop_duplicates().dropna().reset_index(drop=True)
     return gtDf
 
+def formatExons(df):
+    ## Convert exon chains (and junctions) into strings for output,
+    ## i.e., (100-200),(300-400)
+    ## Transcripts without exons are left as they are
+    df = df.copy()
+    if ('exon_list' in df.columns):
+        f = lambda x: exonsToStr(x) if isinstance(x, tuple) else x
+        df['exon_list'] = df['exon_list'].map(f)
+
+    if ('junction_list' in df.columns):
+        f = lambda x: junctionsToStr(x) if isinstance(x, tuple) else x
+        df['junction_list'] = df['junction_list'].map(f)
+
+    return df
+
 #------------------- Private Classes & Functions ------------#
 
 #------------------- Main -----------------------------------#
@@ -7,26 +7,54 @@
 # Standard library imports
 
 # External imports
+import pandas as pd
 
 # Internal imports
 from .common import *
 
 #------------------- Constants ------------------------------#
 
+## Transcripts are the same if they have the same structure
+STRUCTURE_COLS = ['start', 'end', 'seqname', 'strand', 'exon_list']
+STRUCTURE_KEY  = 'structure_key'
+
 #------------------- Public Classes & Functions -------------#
 
+def getStructureKeys(df):
+    ## 64-bit key for the structure of each transcript. Exon chains are
+    ## hashed first (hashes of integer tuples are the same in every
+    ## process), then combined with the other columns
+    f     = lambda x: hash(x) if isinstance(x, tuple) else 0
+    eHash = df['exon_list'].map(f).astype('int64')
+    kDf   = df[STRUCTURE_COLS].assign(exon_list=eHash)
+    keys  = pd.util.hash_pandas_object(kDf, index=False)
+    return keys
+
 def dropDuplicates(df, geneId=False):
-    cols = ['start', 'end', 'seqname', 'strand', 'exon_list']
+    cols = [STRUCTURE_KEY]
     if (geneId):
         ## Add the 'gene_id' if we have the column
         cols = cols + ['gene_id']
 
+    ## Transcripts with an incomplete structure can't be compared
+    df = df.dropna(subset=STRUCTURE_COLS + cols[1:])
+    df = df.assign(**{STRUCTURE_KEY:getStructureKeys(df)})
+
     ## Remove duplicates and collapse IDs
-    f  = lambda x: ','.join(set(x))
-    df = df.groupby(cols)['transcript_id'].apply(f)
-    df = df.reset_index()
-    df = df.rename(columns={'transcript_id':'transcript_ids'})
-    df = df.reset_index(drop=True)
+    f   = lambda x: ','.join(set(x))
+    tDf = df.groupby(cols, observed=True)['transcript_id'].apply(f)
+    tDf = tDf.reset_index()
+    tDf = tDf.rename(columns={'transcript_id':'transcript_ids'})
+    tDf = joinStructures(tDf, [df])
+    return tDf
+
+def joinStructures(df, tDfs):
+    ## Add the structure of each transcript back to a table of keys
+    sDfs = [tDf[STRUCTURE_COLS + [STRUCTURE_KEY]] for tDf in tDfs]
+    sDf  = pd.concat(sDfs).drop_duplicates(STRUCTURE_KEY)
+    df   = df.drop(columns=STRUCTURE_COLS, errors='ignore')
+    df   = sDf.merge(df, on=STRUCTURE_KEY, how='right')
+    df   = df.reset_index(drop=True)
     return df
 
 def explodeDuplicates(tDf):
@@ -41,7 +69,7 @@ def removeSingleTranscriptGenes(gtDf):
     ## Count the number of transcripts per gene and remove
     ## those with only 1 transcript
     f    = lambda x: x['transcript_ids'].count() > 1
-    gtDf = gtDf.groupby('gene_id').filter(f)
+    gtDf = gtDf.groupby('gene_id', observed=True).filter(f)
     gtDf = gtDf.reset_index(drop=True)
     return gtDf   
 
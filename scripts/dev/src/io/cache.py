@@ -0,0 +1,153 @@
+#!/bin/python
+
+#------------------- Description & Notes --------------------#
+
+'''
+On-disk cache of parsed tables (i.e., GXF DataFrames). Tables are stored
+as Parquet files and keyed by the content hash and modification time of
+the source file, and the parameters used to parse it. Least recently used
+tables are removed once the cache grows beyond its size limit.
+
+The cache can be configured with environment variables:
+* GXF_CACHE=0           Turns the cache off
+* GXF_CACHE_DIR         Directory of the cache
+* GXF_CACHE_SIZE_GB     Maximum size of the cache (in GB)
+'''
+
+#------------------- Dependencies ---------------------------#
+
+# Standard library imports
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+# External imports
+import pandas as pd
+
+# Internal imports
+from .common import createDirIfNone
+from .common import removeFileIfExists
+
+#------------------- Constants ------------------------------#
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_DIR     = Path(Path.home(), '.cache', 'K562_PG_isoform_analysis', 'gxf')
+CACHE_SIZE_GB = 10
+CHUNK_SIZE    = 1024 * 1024
+
+## Bump this whenever the way we parse files changes
+CACHE_VERSION = 4
+
+#------------------- Public Classes & Functions -------------#
+
+def isEnabled():
+    return os.environ.get('GXF_CACHE', '1') != '0'
+
+def getCacheKey(filepath, **params):
+    ## The key changes whenever the file or the way we parse it changes
+    s = os.stat(filepath)
+    k = {'hash':getFileHash(filepath), 'mtime':s.st_mtime_ns,
+         'size':s.st_size, 'params':params, 'version':CACHE_VERSION}
+    k = json.dumps(k, sort_keys=True, default=str)
+    k = hashlib.sha1(k.encode()).hexdigest()
+    return k
+
+def getFileHash(filepath):
+    h = hashlib.sha1()
+    with open(filepath, 'rb') as fileHandle:
+        for b in iter(lambda: fileHandle.read(CHUNK_SIZE), b''):
+            h.update(b)
+
+    return h.hexdigest()
+
+def read(key):
+    f = _getCacheFile(key)
+    if (not f.exists()):
+        return None
+
+    try:
+        df = pd.read_parquet(f)
+
+    except Exception as err:
+        ## Corrupted or unreadable table. Remove it so that it gets rebuilt
+        LOGGER.warning("Unable to read cached table ({}): {}".format(f, err))
+        removeFileIfExists(f)
+        return None
+
+    ## Mark the table as recently used
+    os.utime(f)
+    return df
+
+def write(key, df):
+    cacheDir = _getCacheDir()
+    createDirIfNone(cacheDir)
+
+    ## Write to a temporary file first so that other processes
+    ## never see a partially written table
+    f    = _getCacheFile(key)
+    tmpF = Path(cacheDir, ".tmp_{}_{}".format(os.getpid(), f.name))
+    try:
+        df.to_parquet(tmpF, index=False)
+        os.replace(tmpF, f)
+
+    except Exception as err:
+        ## Tables that can't be stored (e.g., missing pyarrow or mixed
+        ## column types) aren't cached. We say so on every run, since every
+        ## run will parse the file again
+        LOGGER.warning("Unable to cache table ({}): {}".format(f, err))
+        removeFileIfExists(tmpF)
+        return
+
+    _evict(cacheDir, _getCacheSize())
+
+def clear():
+    for f in _getCacheDir().glob('*.parquet'):
+        removeFileIfExists(f)
+
+#------------------- Private Classes & Functions ------------#
+
+def _getCacheDir():
+    return Path(os.environ.get('GXF_CACHE_DIR', CACHE_DIR))
+
+def _getCacheSize():
+    gb = float(os.environ.get('GXF_CACHE_SIZE_GB', CACHE_SIZE_GB))
+    return int(gb * 1024 ** 3)
+
+def _getCacheFile(key):
+    return Path(_getCacheDir(), "{}.parquet".format(key))
+
+def _evict(cacheDir, maxSize):
+    ## Remove the least recently used tables until we're within the limit
+    ## Other processes may be using the cache at the same time,
+    ## so tables can disappear while we're looking at them
+    fs = []
+    for f in cacheDir.glob('*.parquet'):
+        try:
+            fs.append((f, f.stat()))
+
+        except FileNotFoundError:
+            continue
+
+    fs.sort(key=lambda x: x[1].st_mtime)
+    totalSize = sum(s.st_size for _, s in fs)
+    for f, s in fs:
+        if (totalSize <= maxSize):
+            break
+
+        try:
+            f.unlink()
+
+        except FileNotFoundError:
+            pass
+
+        totalSize = totalSize - s.st_size
+
+#------------------- Main -----------------------------------#
+
+if (__name__ == "__main__"):
+    main()
+
+#------------------------------------------------------------------------------
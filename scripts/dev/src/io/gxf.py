@@ -5,28 +5,150 @@
 #------------------- Dependencies ---------------------------#
 
 # Standard library imports
+import functools
+import gzip
+import itertools
+import os
 import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
 from pathlib import Path
 
 # External imports
 import pandas as pd
 
 # Internal imports
+from . import cache
 from .common import isZFile
+from .common import removeFileIfExists
 
 #------------------- Constants ------------------------------#
 
 GTF = 'GTF'
 GFF = 'GFF'
 
+COL_NAMES  = ['seqname', 'source', 'feature', 'start',
+              'end', 'score', 'strand', 'frame', 'attribute']
+COL_TYPES  = {'seqname':str, 'source':str, 'feature':str, 'score':str,
+              'strand':str, 'frame':str, 'attribute':str}
+CHUNK_SIZE = 1000000
+
 #------------------- Public Classes & Functions -------------#
 
 def read(*filepaths, **kwargs):
-    fDbs  = (_readFile(f, **kwargs) for f in filepaths)
+    ## Files can be parsed in parallel, but only if we're
+    ## creating (complete) DataFrames
+    nWorkers = kwargs.pop('nWorkers', 1)
+    if (nWorkers > 1 and len(filepaths) > 1
+        and not kwargs.get('asChunks', False)
+        and kwargs.get('asPdf', True)):
+        fDbs = _readFiles(filepaths, nWorkers, **kwargs)
+
+    else:
+        fDbs = (_readFile(f, **kwargs) for f in filepaths)
+
     return fDbs
 
+def readContigs(filepath, **kwargs):
+    ## Read the file one contig at a time. Requires an indexed file,
+    ## which we'll create if it doesn't exist
+    import pysam
+
+    idxFile = index(filepath)
+    with pysam.TabixFile(idxFile) as tbxFile:
+        contigs = list(tbxFile.contigs)
+
+    for c in contigs:
+        fDb = _readFile(idxFile, region=c, **kwargs)
+        yield (c, fDb)
+
+def index(filepath):
+
+    """
+    Description:
+        Creates a tabix index for a GXF file. Plain text (or gzipped) files
+        are sorted and compressed with bgzip first. The sorted copy is
+        written next to the original file (i.e., <name>.sorted.gtf.gz).
+
+    Args:
+        filepath (str):
+            Filepath string.
+
+    Returns:
+        idxFile (str):
+            Filepath string of the bgzipped file with a tabix index.
+    """
+
+    import pysam
+
+    ## Nothing to do if the file is already indexed
+    if (_isBgzfFile(filepath)):
+        if (_hasIndex(filepath)):
+            return filepath
+
+        try:
+            pysam.tabix_index(filepath, preset='gff')
+            return filepath
+
+        except OSError:
+            ## Probably because the file isn't sorted
+            pass
+
+    ## Reuse the sorted copy unless the original has changed since
+    sortedFile = _getSortedFilepath(filepath)
+    idxFile    = sortedFile + '.gz'
+    if (_hasIndex(idxFile)
+        and os.path.getmtime(idxFile) >= os.path.getmtime(filepath)):
+        return idxFile
+
+    _sortFile(filepath, sortedFile)
+    idxFile = pysam.tabix_index(sortedFile, preset='gff', force=True)
+    return idxFile
+
 #------------------- Private Classes & Functions ------------#
 
+def _readFiles(filepaths, nWorkers, **kwargs):
+    ## Each worker writes its table to an Arrow file, preferably in shared
+    ## memory. Tables are then memory mapped rather than pickled and
+    ## sent back to us. Tables are returned in the same order as the files
+    import pyarrow as pa
+
+    tmpDir = tempfile.mkdtemp(prefix='.tmp_gxf_', dir=_getSharedMemoryDir())
+    try:
+        f = functools.partial(_writeFileAsArrow, tmpDir=tmpDir, **kwargs)
+        with ProcessPoolExecutor(max_workers=nWorkers) as executor:
+            for arrowFile in executor.map(f, filepaths):
+                with pa.memory_map(arrowFile) as source:
+                    fDb = pa.ipc.open_file(source).read_all().to_pandas()
+
+                os.remove(arrowFile)
+                yield fDb
+
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+def _writeFileAsArrow(filepath, tmpDir, **kwargs):
+    import pyarrow as pa
+
+    fDb = _readFile(filepath, **kwargs)
+    t   = pa.Table.from_pandas(fDb)
+    (fd, arrowFile) = tempfile.mkstemp(suffix='.arrow', dir=tmpDir)
+    os.close(fd)
+    with pa.OSFile(arrowFile, 'wb') as sink:
+        with pa.ipc.new_file(sink, t.schema) as writer:
+            writer.write_table(t)
+
+    return arrowFile
+
+def _getSharedMemoryDir():
+    d = '/dev/shm'
+    if (os.path.isdir(d) and os.access(d, os.W_OK)):
+        return d
+
+    return None
+
 def _readFile(filepath, **kwargs):
     if (isZFile(filepath)):
         stem    = Path(filepath).stem
@@ -35,7 +157,24 @@ def _readFile(filepath, **kwargs):
     else:
         gxfType = _getFormat(filepath)
 
-    fDb = _getFeatureDB(filepath, gxfType, **kwargs)
+    ## Reuse the parsed table if we've seen this file before.
+    ## Chunks are streamed straight from the file, so they're never cached
+    ## Regions are quick to read from the index, so they aren't cached either
+    useCache = kwargs.pop('cache', True) and cache.isEnabled()
+    if (not useCache or kwargs.get('asChunks', False)
+        or kwargs.get('region', None) is not None
+        or not kwargs.get('asPdf', True)):
+        fDb = _getFeatureDB(filepath, gxfType, **kwargs)
+        return fDb
+
+    ## The chunk size doesn't change the table, so it isn't part of the key
+    params = {k:v for k, v in kwargs.items() if k != 'chunksize'}
+    key    = cache.getCacheKey(filepath, gxfType=gxfType, **params)
+    fDb    = cache.read(key)
+    if (fDb is None):
+        fDb = _getFeatureDB(filepath, gxfType, **kwargs)
+        cache.write(key, fDb)
+
     return fDb
 
 def _getFormat(filepath):
@@ -50,53 +189,295 @@ def _getFormat(filepath):
         raise NotImplementedError("Unknown GXF file")
 
 def _getFeatureDB(filepath, gxfType, **kwargs):
-    asPdf = kwargs.pop('asPdf', True)
-    attrs = kwargs.pop('attrs', [])
-    fDb   = None
+    asPdf     = kwargs.pop('asPdf', True)
+    asChunks  = kwargs.pop('asChunks', False)
+    attrs     = kwargs.pop('attrs', [])
+    features  = kwargs.pop('features', [])
+    chunksize = kwargs.pop('chunksize', CHUNK_SIZE)
+    compact   = kwargs.pop('compact', False)
+    region    = kwargs.pop('region', None)
+    fDb       = None
     if (asPdf):
-        ## Create DataFrame of the file
-        colNames = ['seqname', 'source', 'feature', 'start',
-                    'end', 'score', 'strand', 'frame', 'attribute']
-        mDf      = pd.read_csv(filepath, sep='\t', comment='#',
-            header=None, names=colNames, low_memory=False)
+        ## Stream the file (or region) in chunks so that we never hold the
+        ## whole (unparsed) file in memory. Columns containing strings are
+        ## read as strings; otherwise their type could change between chunks
+        ## (i.e., scores are numbers or '.')
+        if (region is None):
+            mDfs = pd.read_csv(filepath, sep='\t', comment='#',
+                header=None, names=COL_NAMES, dtype=COL_TYPES,
+                chunksize=chunksize)
+
+        else:
+            mDfs = _fetchRegion(filepath, region, chunksize, gxfType)
 
-        ## Parse the attributes column
-        f   = lambda x: _parseAttributes(x, gxfType, attrs)
-        aDf = mDf['attribute'].apply(f)
+        ## Parse each chunk, keeping only the features we want
+        fDbs = (_parseChunk(mDf, gxfType, attrs, features) for mDf in mDfs)
+        if (asChunks):
+            fDbs = (_compactTable(fDb) for fDb in fDbs) if compact else fDbs
+            return fDbs
 
-        ## Join the tables and adjust column types
-        fDb = pd.concat([mDf, aDf], axis=1)
-        fDb['start'] = fDb['start'].astype(int)
-        fDb['end']   = fDb['end'].astype(int)
+        fDb  = pd.concat(fDbs, sort=False)
+        fDb  = _compactTable(fDb) if compact else fDb
 
     else:
-        import gffutils             ## Requires python 3.5; not 3.7
-        fDb = gffutils.create_db(filepath,
-            ':memory:', force=True, keep_order=True,
-            merge_strategy='merge', sort_attribute_values=True)
+        fDb = _openFeatureDB(filepath)
+
+    return fDb
+
+def _openFeatureDB(filepath):
+    ## Feature databases are stored next to the original file
+    ## (i.e., <name>.gtf.db) and rebuilt whenever the file changes
+    import gffutils             ## Requires python 3.5; not 3.7
 
-        fDb.update(fDb.create_introns())
+    dbFile = str(filepath) + '.db'
+    key    = _getFeatureDBKey(filepath)
+    if (os.path.exists(dbFile)):
+        try:
+            fDb = gffutils.FeatureDB(dbFile)
+            if (_readFeatureDBKey(fDb) == key):
+                return fDb
 
+            fDb.conn.close()
+
+        except Exception:
+            ## Corrupted or incomplete database. Rebuild it
+            pass
+
+    ## Build the database in a temporary file first so that other
+    ## processes never see a partially written database
+    tmpFile = os.path.join(os.path.dirname(dbFile),
+        '.tmp_{}_{}'.format(os.getpid(), os.path.basename(dbFile)))
+    try:
+        _createFeatureDB(filepath, tmpFile, key)
+        os.replace(tmpFile, dbFile)
+
+    except Exception:
+        removeFileIfExists(tmpFile)
+        raise
+
+    fDb = gffutils.FeatureDB(dbFile)
     return fDb
 
-def _parseAttributes(row, gxfType, attrs):
+def _createFeatureDB(filepath, dbFile, key):
+    import gffutils
+
+    fDb = gffutils.create_db(filepath,
+        dbFile, force=True, keep_order=True,
+        merge_strategy='merge', sort_attribute_values=True)
+
+    ## Introns are added (and indexed) along with everything else
+    fDb.update(fDb.create_introns(), make_backup=False)
+    fDb.conn.execute('CREATE TABLE gxf_source (key TEXT)')
+    fDb.conn.execute('INSERT INTO gxf_source VALUES (?)', (key,))
+    fDb.conn.commit()
+    fDb.conn.close()
+
+def _getFeatureDBKey(filepath):
+    ## Cheap enough to check on every run; hashing a whole
+    ## reference file would take longer than opening its database
+    s = os.stat(filepath)
+    k = '{}:{}:{}'.format(s.st_size, s.st_mtime_ns, cache.CACHE_VERSION)
+    return k
+
+def _readFeatureDBKey(fDb):
+    try:
+        r = fDb.conn.execute('SELECT key FROM gxf_source').fetchone()
+        return r[0] if r is not None else None
+
+    except Exception:
+        return None
+
+def _fetchRegion(filepath, region, chunksize, gxfType):
+    ## Features overlapping the region (i.e., 'chr1' or 'chr1:1-5000000')
+    import pysam
+
+    idxFile = index(filepath)
+    with pysam.TabixFile(idxFile) as tbxFile:
+        (contig, start, end) = _parseRegion(region)
+        if (contig not in tbxFile.contigs):
+            lines = iter([])
+
+        elif (start is None):
+            lines = tbxFile.fetch(contig)
+
+        else:
+            lines = _fetchTranscripts(tbxFile, contig, start, end, gxfType)
+
+        isEmpty = True
+        while True:
+            l = list(itertools.islice(lines, chunksize))
+            if (len(l) == 0):
+                break
+
+            isEmpty = False
+            yield pd.read_csv(StringIO('\n'.join(l)), sep='\t',
+                header=None, names=COL_NAMES, dtype=COL_TYPES)
+
+    ## Nothing in the region. Make sure we still get a (empty) table
+    if (isEmpty):
+        yield pd.DataFrame(columns=COL_NAMES)
+
+def _fetchTranscripts(tbxFile, contig, start, end, gxfType):
+    ## Transcripts crossing the edges of the region would otherwise lose the
+    ## exons outside of it. So we find the transcripts overlapping the region
+    ## and widen the region until it covers all of their features (i.e.,
+    ## their transcript feature). Features without a transcript (i.e.,
+    ## genes) are only kept if they overlap the region itself
+    p = re.compile(_getAttributePattern('transcript_id', gxfType))
+    f = lambda l: _parseLine(l, p)
+    fetch = lambda s, e: map(f, tbxFile.fetch(contig, s - 1, e))
+
+    tIds = set(t for (t, _, _, _) in fetch(start, end) if t is not None)
+    (wStart, wEnd) = (start, end)
+    while True:
+        (nStart, nEnd) = (wStart, wEnd)
+        for (t, s, e, _) in fetch(wStart, wEnd):
+            if (t in tIds):
+                nStart = min(nStart, s)
+                nEnd   = max(nEnd, e) if nEnd is not None else None
+
+        if ((nStart, nEnd) == (wStart, wEnd)):
+            break
+
+        (wStart, wEnd) = (nStart, nEnd)
+
+    for (t, s, e, l) in fetch(wStart, wEnd):
+        if (t in tIds
+            or (t is None and e >= start and (end is None or s <= end))):
+            yield l
+
+def _parseRegion(region):
+    ## i.e., 'chr1' -> (chr1, None, None) and
+    ## 'chr1:1,000-5,000' -> (chr1, 1000, 5000)
+    m = re.match(r'^(.+):([0-9,]+)(?:-([0-9,]+))?$', region)
+    if (m is None):
+        return (region, None, None)
+
+    (contig, start, end) = m.groups()
+    start = max(int(start.replace(',', '')), 1)
+    end   = int(end.replace(',', '')) if end is not None else None
+    return (contig, start, end)
+
+def _parseLine(l, p):
+    ## (transcript ID, start, end, line) of a feature
+    x = l.split('\t')
+    m = p.match(x[8])
+    t = m.group(1) if m is not None else None
+    return (t, int(x[3]), int(x[4]), l)
+
+def _sortFile(filepath, sortedFile):
+    ## Sort features by contig and start position. Comments
+    ## are kept at the top of the file
+    comments = []
+    features = []
+    with _openFile(filepath) as fileHandle:
+        for l in fileHandle:
+            if (l.startswith('#')):
+                comments.append(l)
+
+            elif (l.strip() != ''):
+                x = l.split('\t', 4)
+                features.append((x[0], int(x[3]), int(x[4].split('\t', 1)[0]), l))
+
+    features.sort(key=lambda x: x[0:3])
+    with open(sortedFile, 'w') as fileHandle:
+        fileHandle.writelines(comments)
+        fileHandle.writelines(x[3] for x in features)
+
+def _openFile(filepath):
+    if (isZFile(filepath)):
+        return gzip.open(filepath, 'rt')
+
+    return open(filepath, 'r')
+
+def _isBgzfFile(filepath):
+    ## BGZF files are gzip files with a 'BC' extra field
+    with open(filepath, 'rb') as fileHandle:
+        h = fileHandle.read(16)
+
+    return bool(len(h) >= 14 and h[0:2] == b'\x1f\x8b'
+            and (h[3] & 4) and h[12:14] == b'BC')
+
+def _hasIndex(filepath):
+    return (os.path.exists(filepath + '.tbi')
+            or os.path.exists(filepath + '.csi'))
+
+def _getSortedFilepath(filepath):
+    ## i.e., <name>.gtf[.gz] -> <name>.sorted.gtf
+    p = Path(filepath)
+    p = p.with_suffix('') if isZFile(filepath) else p
+    return str(p.with_suffix('.sorted' + p.suffix))
+
+def _parseChunk(mDf, gxfType, attrs, features):
+    ## Remove features we don't want before parsing anything else
+    if (len(features) != 0):
+        cond = (mDf['feature'].isin(features))
+        mDf  = mDf[cond]
+
+    ## Parse the attributes column
+    aDf = _parseAttributes(mDf['attribute'], gxfType, attrs)
+
+    ## Join the tables and adjust column types
+    fDb = pd.concat([mDf, aDf], axis=1)
+    fDb['start'] = fDb['start'].astype(int)
+    fDb['end']   = fDb['end'].astype(int)
+    return fDb
+
+def _compactTable(fDb):
+    ## The raw attributes take up most of the memory, and we've
+    ## already parsed the ones we want
+    fDb = fDb.drop(columns=['attribute'])
+
+    ## Low cardinality columns and IDs (i.e., parsed attributes) are stored
+    ## as categoricals, while coordinates and scores are stored as 32-bit
+    ## numbers. Genomic coordinates will never be > 2^31
+    aCols = [c for c in fDb.columns if c not in COL_NAMES]
+    cCols = ['seqname', 'source', 'feature', 'strand', 'frame'] + aCols
+    fDb   = fDb.astype({c:'category' for c in cCols})
+    fDb   = fDb.astype({'start':'int32', 'end':'int32'})
+    fDb['score'] = pd.to_numeric(fDb['score'], errors='coerce') \
+        .astype('float32')
+    return fDb
+
+def _parseAttributes(attrCol, gxfType, attrs):
+    ## Find the attributes we want. If we haven't asked
+    ## for any, then we'll get every attribute in the file
+    if (len(attrs) == 0):
+        attrs = _getAttributeKeys(attrCol, gxfType)
+
+    ## Extract the values of each attribute column by column rather than
+    ## row by row. Attributes we've asked for are always kept (i.e., even
+    ## if they aren't found in any row, or there are no rows) so that every
+    ## table (i.e., chunk or region) has the same columns
+    aDf = {}
+    for k in attrs:
+        p = _getAttributePattern(k, gxfType)
+        aDf[k] = attrCol.astype(object).str.extract(p, expand=False)
+
+    aDf = pd.DataFrame(aDf, index=attrCol.index)
+    return aDf
+
+def _getAttributeKeys(attrCol, gxfType):
+    if (gxfType == GFF):
+        p = '(?:^|;)([^;=]+)='
+
+    else:
+        p = r'(?:^|; )(\S+) "'
+
+    keys = attrCol.str.findall(p).explode().dropna().unique()
+    return list(keys)
+
+def _getAttributePattern(key, gxfType):
+    ## Attributes are separated by '; ' (GTF) or ';' (GFF). The leading
+    ## greedy group ensures we get the last value if a key is repeated
+    ## (i.e., 'tag' in Ensembl GTFs)
     if (gxfType == GFF):
-        l = dict(x.split('=') for x in row.split(';'))
+        p = '^(?:.*;)?{}=([^;]*)'.format(re.escape(key))
 
     else:
-        l = {}
-        for x in row.split('; '):
-            m = re.match('(.*) "(.*)"', x)
-            k = m.group(1)
-            v = m.group(2)
-            l[k] =v
-
-    l = pd.Series(l)
-    if (len(attrs) != 0):
-        colsToRemove = set(l.index).difference(attrs)
-        l = l.drop(colsToRemove)
-
-    return l
+        p = '^(?:.*; )?{} "([^"]*)"'.format(re.escape(key))
+
+    return p
 
 #------------------- Main -----------------------------------#
 
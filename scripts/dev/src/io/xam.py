@@ -6,22 +6,42 @@
 
 # Standard library imports
 import os
+import re
+import math
+import shutil
+import tempfile
+import functools
 import itertools
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 # External imports
+import numpy as np
 import pysam
 
 # Internal imports
 from .common import isZFile
 from .common import createDirIfNone
 from .common import removeFileIfExists
+from ..xam import parseCigarStrings
 
 #------------------- Constants ------------------------------#
 
 BAM = 'b'
 SAM = 's'
 
+## Contig of unmapped reads without coordinates
+UNPLACED = '*'
+
+## Columns of XAM tables (see toTable). Positions are 1-based and
+## inclusive, and the CIGAR of each read is stored as lists of
+## operations and lengths
+TABLE_COLS = ['query_name', 'flag', 'contig', 'pos', 'end', 'mapq',
+    'query_length', 'cigar_ops', 'cigar_lens', 'md', 'nm']
+
+## Number of reads that we write at once
+BATCH_SIZE = 100000
+
 #------------------- Public Classes & Functions -------------#
 
 def read(*filepaths, **kwargs):
@@ -29,27 +49,441 @@ def read(*filepaths, **kwargs):
     alignRecs = itertools.chain(*alignRecs)
     return alignRecs
 
-def write(filepath, xamRecords, template):
+def write(filepath, xamRecords, template, threads=1):
     ## Create DIR if it doesnt exist
     outputDir = os.path.dirname(filepath)
     createDirIfNone(outputDir)
     removeFileIfExists(filepath)
 
-    tFile = _readFile(template)
-    f = pysam.AlignmentFile(filepath, 'w', template=tFile)
-    for x in xamRecords:
-        f.write(x)
+    ## Compression can use several threads (BAM only)
+    with _readFile(template) as tFile, \
+         _writeFile(filepath, tFile, threads) as f:
+        for x in xamRecords:
+            f.write(x)
+
+def writeRegions(filepath, f, regions, template, nWorkers=1, threads=1):
+
+    """
+    Description:
+        Writes the reads of each region returned by f (i.e., filtered
+        reads) to a BAM file. Reads (i.e., pysam records) can't be
+        pickled, so each region is written to its own (temporary) BAM
+        file by a worker. Files are then concatenated in the same order as
+        the regions without decompressing them.
+
+    Args:
+        filepath (str):
+            Filepath string of the BAM file.
+        f (function):
+            Function of the reads of a region (i.e., f(readRegion(region)))
+            that returns the reads to write. Must be picklable.
+        regions (list of tuple):
+            Regions (see getRegions).
+        template (str):
+            Filepath string of the XAM file with the header.
+        nWorkers (int):
+            Number of regions to write in parallel.
+        threads (int):
+            Number of compression threads of each worker.
+    """
+
+    if (_getFileFormat(filepath) != BAM):
+        raise ValueError("Regions can only be written to BAM files")
+
+    outputDir = os.path.dirname(filepath)
+    createDirIfNone(outputDir)
+    removeFileIfExists(filepath)
+
+    tmpDir = tempfile.mkdtemp(prefix='.tmp_xam_', dir=outputDir or None)
+    try:
+        g = functools.partial(_writeRegion, f=f, template=template,
+            tmpDir=tmpDir, threads=threads)
+        if (nWorkers == 1):
+            tmpFiles = list(map(g, enumerate(regions)))
+
+        else:
+            with ProcessPoolExecutor(max_workers=nWorkers) as executor:
+                tmpFiles = list(executor.map(g, enumerate(regions)))
+
+        pysam.cat('-o', filepath, *tmpFiles)
+
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+def getRegions(filepath, region=None, numShards=None, contigs=None):
+
+    """
+    Description:
+        Splits an (indexed) XAM file into regions (i.e., shards) that can
+        be read independently, i.e., by Spark tasks or worker processes.
+        Every read belongs to exactly one region; reads that span several
+        regions belong to the region they start in. Unmapped reads without
+        coordinates get a region of their own. Files without an index have
+        a single region (i.e., the whole file).
+
+    Args:
+        filepath (str):
+            Filepath string.
+        region (str):
+            Only split reads within a region (i.e., chr1:1-5000000).
+            Reads overlapping the region are included, and unmapped reads
+            without coordinates are excluded.
+        numShards (int):
+            Roughly how many regions we want. Contigs are split into
+            windows of (roughly) the same number of reads according to the
+            index statistics. By default, each contig is a region.
+        contigs (list of str):
+            Only split reads of these contigs. Other contigs are never
+            read.
+
+    Returns:
+        regions (list of tuple):
+            (filepath, contig, start, end, minStart) of each region.
+            Reads are fetched from contig:start-end (0-based, half-open),
+            and reads starting before minStart are skipped.
+    """
+
+    with _readFile(filepath) as alignF:
+        if (not alignF.is_bam or not alignF.has_index()):
+            return [(filepath, None, None, None, None)]
+
+        lengths = dict(zip(alignF.references, alignF.lengths))
+        counts  = {s.contig:s.total for s in alignF.get_index_statistics()}
+        numUnplaced = alignF.nocoordinate
+
+    ## Contigs (or the region) with reads. For regions, we estimate the
+    ## number of reads from the number of reads of the whole contig
+    if (region is None):
+        bounds = [(c, 0, lengths[c]) for c in lengths if counts.get(c, 0)]
+        bounds = [b for b in bounds if contigs is None or b[0] in contigs]
+
+    else:
+        (c, start, end) = _parseRegion(region, lengths)
+        counts = {c:math.ceil(counts.get(c, 0) * (end - start) / lengths[c])}
+        bounds = [(c, start, end)] if counts[c] != 0 else []
+
+    total  = max(sum(counts[c] for c, _, _ in bounds), 1)
+    target = total if numShards is None else math.ceil(total / numShards)
+
+    ## Split each contig into windows. Reads overlapping the start of
+    ## the first window are included (i.e., those that overlap the region)
+    regions = []
+    for c, start, end in bounds:
+        n    = 1 if numShards is None else math.ceil(counts[c] / target)
+        size = max(math.ceil((end - start) / n), 1)
+        for s in range(start, end, size):
+            minStart = None if s == start else s
+            regions.append((filepath, c, s, min(s + size, end), minStart))
+
+    if (region is None and numUnplaced != 0
+        and (contigs is None or UNPLACED in contigs)):
+        regions.append((filepath, UNPLACED, None, None, None))
+
+    return regions
+
+def getNumReads(filepath):
+    ## Number of reads from the index statistics (i.e., without reading
+    ## the file). Returns None if the file doesn't have an index
+    with _readFile(filepath) as alignF:
+        if (not alignF.is_bam or not alignF.has_index()):
+            return None
+
+        return alignF.mapped + alignF.unmapped
+
+def readRegion(region, threads=1, flagInclude=0, flagExclude=0, minMapq=0,
+    contigs=None, **kwargs):
+    ## Reads of a region (see getRegions). Reads can be filtered
+    ## like in read (see _filterRecords)
+    (filepath, contig, start, end, minStart) = region
+    with _readFile(filepath, threads) as alignF:
+        if (contig is None):
+            alignIter = alignF.fetch(until_eof=True, **kwargs)
+
+        else:
+            alignIter = alignF.fetch(contig, start, end, **kwargs)
+
+        if (minStart is not None):
+            alignIter = (x for x in alignIter if x.reference_start >= minStart)
+
+        yield from _filterRecords(alignIter, alignF, flagInclude,
+            flagExclude, minMapq, contigs)
+
+def mapRegions(f, regions, nWorkers=1, **kwargs):
+    ## Apply f to the reads of each region (i.e., f(readRegion(region))).
+    ## Regions are processed in parallel when there are several workers, in
+    ## which case f (and its results) must be picklable. Results are
+    ## returned in the same order as the regions
+    g = functools.partial(_mapRegion, f=f, **kwargs)
+    if (nWorkers == 1):
+        yield from map(g, regions)
+        return
+
+    with ProcessPoolExecutor(max_workers=nWorkers) as executor:
+        yield from executor.map(g, regions)
+
+def toTable(filepath, tableDir, numShards=None, nWorkers=1, threads=1):
+
+    """
+    Description:
+        Converts a XAM file into a table of alignments, so that they can
+        be read again (i.e., by Spark tasks) without decoding the XAM file.
+        The table is a directory of Parquet files (i.e., parts), one for
+        each region of the XAM file (see getRegions). Parts are written in
+        parallel when there are several workers.
+
+    Args:
+        filepath (str):
+            Filepath string of the XAM file.
+        tableDir (str):
+            Directory of the table. Existing parts are replaced.
+        numShards (int):
+            Roughly how many parts we want (see getRegions).
+        nWorkers (int):
+            Number of parts to write in parallel.
+        threads (int):
+            Number of decompression threads of each worker.
+
+    Returns:
+        tableParts (list of str):
+            Filepath strings of the parts (in order).
+    """
+
+    createDirIfNone(tableDir)
+    for f in getTableParts(tableDir):
+        removeFileIfExists(f)
+
+    regions = getRegions(filepath, numShards=numShards)
+    g = functools.partial(_writeTablePart, tableDir=tableDir, threads=threads)
+    if (nWorkers == 1):
+        tableParts = list(map(g, enumerate(regions)))
+
+    else:
+        with ProcessPoolExecutor(max_workers=nWorkers) as executor:
+            tableParts = list(executor.map(g, enumerate(regions)))
+
+    return tableParts
+
+def getTableParts(tableDir):
+    return sorted(str(f) for f in Path(tableDir).glob('part-*.parquet'))
+
+def readTable(filepath, columns=None, region=None, flagInclude=0,
+    flagExclude=0, minMapq=0, contigs=None):
+
+    """
+    Description:
+        Reads a table (or a part) of alignments (see toTable). Only the
+        columns we need are read.
+
+    Args:
+        filepath (str):
+            Filepath string of the table or part.
+        columns (list of str):
+            Columns to read. By default, all columns (see TABLE_COLS).
+        region (str):
+            Only read alignments overlapping a region (i.e., chr1:1-5000000).
+        flagInclude, flagExclude, minMapq, contigs:
+            Only read alignments that pass these filters (see read).
+
+    Returns:
+        t (pyarrow.Table):
+            Alignments in the same order as the XAM file.
+    """
+
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    ## Filters on the position, MAPQ and contig are pushed down to
+    ## the Parquet reader. Reads without coordinates don't have a contig
+    ## (i.e., it's null), so these can't be pushed down
+    filters = [('mapq', '>=', minMapq)]
+    if (region is not None):
+        header  = _getTableHeader(filepath)
+        lengths = dict(zip(header.references, header.lengths))
+        (contig, start, end) = _parseRegion(region, lengths)
+        filters += [('contig', '=', contig), ('pos', '<=', end),
+                    ('end', '>', start)]
+
+    if (contigs is not None and UNPLACED not in contigs):
+        filters.append(('contig', 'in', list(contigs)))
+
+    cols = columns
+    if (columns is not None):
+        cols = list(dict.fromkeys(list(columns) + ['flag', 'contig']))
+
+    t = pq.read_table(filepath, columns=cols, filters=filters)
+    isValid = pc.equal(pc.bit_wise_and(t.column('flag'), flagInclude),
+        flagInclude)
+    isValid = pc.and_(isValid,
+        pc.equal(pc.bit_wise_and(t.column('flag'), flagExclude), 0))
+    if (contigs is not None and UNPLACED in contigs):
+        isValid = pc.and_(isValid, pc.or_(pc.is_null(t.column('contig')),
+            pc.is_in(t.column('contig'), pa.array(list(contigs)))))
 
-    f.close()
+    t = t.filter(isValid)
+    if (columns is not None):
+        t = t.select(columns)
+
+    return t
+
+def getTableCigars(t):
+    ## Flattened CIGARs of the alignments in a table (or a batch), i.e.,
+    ## the same as parseCigarStrings. These are stored as lists, so we
+    ## only need their values and offsets
+    (ops, lens) = (_getColumn(t, 'cigar_ops'), _getColumn(t, 'cigar_lens'))
+    offsets = np.asarray(ops.offsets, dtype=np.int64)
+    offsets = offsets - offsets[0]
+    ops     = np.asarray(ops.flatten(), dtype=np.int64)
+    lens    = np.asarray(lens.flatten(), dtype=np.int64)
+    return (ops, lens, offsets)
 
 #------------------- Private Classes & Functions ------------#
 
-def _readRecords(filepath, **kwargs):
-    alignF    = _readFile(filepath)
+def _mapRegion(region, f, **kwargs):
+    return f(readRegion(region, **kwargs))
+
+def _writeRegion(x, f, template, tmpDir, threads):
+    (i, region) = x
+    tmpFile = os.path.join(tmpDir, '{}.bam'.format(i))
+    write(tmpFile, f(readRegion(region)), template, threads)
+    return tmpFile
+
+def _writeTablePart(x, tableDir, threads):
+    import pyarrow.parquet as pq
+
+    (i, region) = x
+    tablePart = os.path.join(tableDir, 'part-{:05d}.parquet'.format(i))
+    with _readFile(region[0]) as alignF:
+        schema = _getTableSchema(alignF.header)
+
+    ## Write the reads of the region in batches
+    xamRecs = readRegion(region, threads=threads)
+    with pq.ParquetWriter(tablePart, schema) as writer:
+        while True:
+            batch = list(itertools.islice(xamRecs, BATCH_SIZE))
+            if (len(batch) == 0):
+                break
+
+            writer.write_table(_toArrowTable(batch, schema))
+
+    return tablePart
+
+def _toArrowTable(xamRecs, schema):
+    import pyarrow as pa
+
+    ## Unmapped reads don't have a position or CIGAR
+    recs = [(x.query_name, x.flag, x.reference_name, x.reference_start + 1,
+             x.reference_end or 0, x.mapping_quality, x.query_length,
+             x.cigarstring or '',
+             x.get_tag('MD') if x.has_tag('MD') else None,
+             x.get_tag('NM') if x.has_tag('NM') else None)
+            for x in xamRecs]
+    cols = list(zip(*recs))
+
+    (ops, lens, offsets) = parseCigarStrings(cols[7])
+    offsets = pa.array(offsets, type=pa.int32())
+    arrays  = [pa.array(cols[i], type=schema.field(c).type)
+               for i, c in enumerate(TABLE_COLS[:7])]
+    arrays += [pa.ListArray.from_arrays(offsets, pa.array(ops, type=pa.int8())),
+               pa.ListArray.from_arrays(offsets, pa.array(lens, type=pa.int32())),
+               pa.array(cols[8], type=pa.string()),
+               pa.array(cols[9], type=pa.int32())]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def _getTableSchema(header):
+    ## The header is kept with the table, i.e., for the contig lengths
+    import pyarrow as pa
+
+    types  = [pa.string(), pa.int32(), pa.string(), pa.int64(), pa.int64(),
+              pa.int32(), pa.int32(), pa.list_(pa.int8()),
+              pa.list_(pa.int32()), pa.string(), pa.int32()]
+    schema = pa.schema(list(zip(TABLE_COLS, types)))
+    schema = schema.with_metadata({'header':str(header)})
+    return schema
+
+def _getTableHeader(filepath):
+    import pyarrow.parquet as pq
+
+    if (os.path.isdir(filepath)):
+        filepath = getTableParts(filepath)[0]
+
+    metadata = pq.read_schema(filepath).metadata
+    header   = pysam.AlignmentHeader.from_text(metadata[b'header'].decode())
+    return header
+
+def _getColumn(t, c):
+    import pyarrow as pa
+
+    x = t.column(c)
+    if (isinstance(x, pa.ChunkedArray)):
+        x = x.combine_chunks()
+
+    return x
+
+def _parseRegion(region, lengths):
+    ## i.e., chr1 or chr1:1-5000000 (1-based, inclusive) to
+    ## (chr1, 0, 5000000) (0-based, half-open)
+    m = re.match('^(.+?)(?::([0-9,]+)(?:-([0-9,]+))?)?$', region)
+    (contig, start, end) = m.groups()
+    if (contig not in lengths):
+        raise ValueError("Unknown contig ({})".format(contig))
+
+    start = 0 if start is None else int(start.replace(',', '')) - 1
+    end   = lengths[contig] if end is None else int(end.replace(',', ''))
+    return (contig, start, end)
+
+def _readRecords(filepath, threads=1, flagInclude=0, flagExclude=0,
+    minMapq=0, contigs=None, **kwargs):
+    alignF    = _readFile(filepath, threads)
     alignIter = alignF.fetch(until_eof=True, **kwargs)
-    yield from alignIter
+    yield from _filterRecords(alignIter, alignF, flagInclude, flagExclude,
+        minMapq, contigs)
 
-def _readFile(filepath):
+def _filterRecords(alignIter, alignF, flagInclude, flagExclude, minMapq,
+    contigs):
+    ## Reads must have all of the flags in flagInclude, none of the flags
+    ## in flagExclude, a MAPQ >= minMapq and be on one of the contigs.
+    ## We only look at the (integer) fields of each read, so rejected
+    ## reads are skipped before anything else about them is decoded
+    if (not flagInclude and not flagExclude and not minMapq
+        and contigs is None):
+        yield from alignIter
+        return
+
+    tids = None
+    if (contigs is not None):
+        ## Reads without coordinates have a contig ID of -1
+        tids = {alignF.get_tid(c) for c in contigs if c != UNPLACED}
+        tids.discard(-1)
+        if (UNPLACED in contigs):
+            tids.add(-1)
+
+    for x in alignIter:
+        flag = x.flag
+        if ((flag & flagInclude) != flagInclude or (flag & flagExclude)):
+            continue
+
+        if (x.mapping_quality < minMapq):
+            continue
+
+        if (tids is not None and x.reference_id not in tids):
+            continue
+
+        yield x
+
+def _readFile(filepath, threads=1):
+    ## Decompression can use several threads (BAM only)
+    xamType   = _getFileFormat(filepath)
+    alignF    = pysam.AlignmentFile(filepath, 'r' + xamType, threads=threads)
+    return alignF
+
+def _writeFile(filepath, template, threads=1):
+    xamType   = _getFileFormat(filepath)
+    alignF    = pysam.AlignmentFile(filepath, 'w' + xamType,
+        template=template, threads=threads)
+    return alignF
+
+def _getFileFormat(filepath):
     if (isZFile(filepath)):
         stem    = Path(filepath).stem
         xamType = _getFormat(stem)
@@ -57,8 +491,7 @@ def _readFile(filepath):
     else:
         xamType = _getFormat(filepath)
 
-    alignF    = pysam.AlignmentFile(filepath, 'r' + xamType)
-    return alignF
+    return xamType
 
 def _getFormat(filepath):
     if (filepath.endswith('.bam')):
@@ -11,11 +11,24 @@
 # Internal imports
 from .common import getEnd
 from .common import getStart
-from .common import exonStrToTuple
-from .common import exonStrListToJunctionStrList
-from .common import sortExonStrList
+from .common import exonsToJunctions
+from .common import exonsToStr
+from .common import junctionsToStr
+from .common import sortExons
 from .common import compareData
+from .common import compareSketches
+from .common import mergeData
 from .common import toSet
+from .common import intersect
+from .common import difference
+from .common import findCollisions
+from .common import toSketch
+from .common import hashRows
+
+from .interval import IntervalIndex
+from .sketch import HyperLogLog
+from .sketch import QuantileSketch
+from .sketch import Summary
 
 #------------------- Constants ------------------------------#
 
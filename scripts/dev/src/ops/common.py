@@ -5,85 +5,221 @@
 #------------------- Dependencies ---------------------------#
 
 # Standard library imports
-import re
+import collections
+import functools
 import itertools
 
 # External imports
+import numpy as np
 import pandas as pd
 
 # Internal imports
+from .sketch import PRECISION
+from .sketch import HyperLogLog
+from .sketch import getUnionEstimates
 
 #------------------- Constants ------------------------------#
 
 #------------------- Public Classes & Functions -------------#
 
-def sortExonStrList(exStrList):
-    exStrList = [exonStrToTuple(e) for e in exStrList]
-    exStrList = [(int(e[0]), int(e[1])) for e in exStrList]
-    exStrList.sort(key=lambda x: x[0])
-    exStrList = ["({}-{})".format(e[0], e[1]) for e in exStrList]
-    return exStrList
-
-def exonStrToTuple(e):
-    return tuple(re.sub('[()]', '', e).split('-'))
-
-def getStart(exStrList):
-    s = sortExonStrList(exStrList)
-    e = exonStrToTuple(s[0])
-    return e[0]
-
-def getEnd(exStrList):
-    s = sortExonStrList(exStrList)
-    e = exonStrToTuple(s[-1])
-    return e[1]
-
-def exonStrListToJunctionStrList(exStrList):
-    exStrList = sortExonStrList(exStrList)
-    exStrList = [exonStrToTuple(e) for e in exStrList]
-    rJunStart = [ex[1] for ex in exStrList[:-1]]
-    rJunEnd   = [ex[0] for ex in exStrList[1:]]
-    rJunPos   = ["({}:{})".format(s, e) for s, e in zip(rJunStart, rJunEnd)]
-    return rJunPos
+## Exon chains are tuples of (start, end) tuples sorted by their
+## genomic coordinates, i.e., ((100, 200), (300, 400)). Junctions are
+## tuples of (end, start) tuples of consecutive exons. Both are only
+## converted to strings when we write them out
+def sortExons(exons):
+    return tuple(sorted(exons))
+
+def getStart(exons):
+    return exons[0][0]
+
+def getEnd(exons):
+    return exons[-1][1]
+
+def exonsToJunctions(exons):
+    rJunStart = [ex[1] for ex in exons[:-1]]
+    rJunEnd   = [ex[0] for ex in exons[1:]]
+    return tuple(zip(rJunStart, rJunEnd))
+
+def exonsToStr(exons):
+    return ','.join("({}-{})".format(s, e) for s, e in exons)
+
+def junctionsToStr(juns):
+    return ','.join("({}:{})".format(s, e) for s, e in juns)
 
 def compareData(dataDict):
-    ## Find combinations between each set
-    ## * Combinations we want
-    ## * Combinations we don't want
-    numSets = len(dataDict.keys())
-    tCombs  = [itertools.combinations(dataDict.keys(), i) for i in range(1, numSets + 1)]
-    tCombs  = list(itertools.chain(*tCombs))
-    fCombs  = [tuple(set(dataDict.keys()).difference(set(c))) for c in tCombs]
-
-    ## Find the intersection and differences between each set
-    r = [_getIntersection(dataDict, tc, fc) for tc, fc in zip(tCombs, fCombs)]
-
-    ## Construct the table
-    r = pd.DataFrame(r)
-    r = r.fillna(False)
-    r = r[[c for c in r.columns if c != 'Count'] + ['Count'] ]
+    ## Find the sets that each element belongs to. Each set is
+    ## represented by a bit, so elements that belong to the same sets
+    ## (i.e., the same region of the Venn diagram) have the same bitmask
+    if (all(isinstance(s, np.ndarray) for s in dataDict.values())):
+        masks = _getArrayMasks(list(dataDict.values()))
+
+    else:
+        masks = _getSetMasks(list(dataDict.values()))
+
+    ## Count the number of elements in each region
+    (masks, counts) = np.unique(masks, return_counts=True)
+    counts = dict(zip(masks.tolist(), counts.tolist()))
+    combs  = _getCombinations(len(dataDict))
+    r = _getCountTable(dataDict.keys(), combs)
+    r['Count'] = [counts.get(c, 0) for c in combs.tolist()]
+    return r
+
+def compareSketches(sketchDict):
+    ## Estimate the number of elements in each region of the Venn diagram
+    ## from the size of the union of each combination of sets (U).
+    ## Elements in exactly the sets T is given by inclusion-exclusion:
+    ## * sum((-1)^(|T| - |C| + 1) * U(~C)) for each subset C of T
+    sketches = list(sketchDict.values())
+    n        = len(sketches)
+    full     = (1 << n) - 1
+    u        = getUnionEstimates(sketches)
+    c        = -u[full ^ np.arange(full + 1)]
+
+    ## Transform over subsets, one set at a time
+    for i in range(n):
+        cView = c.reshape(-1, 2, 1 << i, c.shape[-1])
+        cView[:, 1] -= cView[:, 0]
+
+    ## The error is estimated from the spread of the bucket estimates
+    combs = _getCombinations(n)
+    c     = c[combs]
+    err   = c[:, 1:].std(axis=1, ddof=1) / np.sqrt(c.shape[-1] - 1)
+    r = _getCountTable(sketchDict.keys(), combs)
+    r['Count']    = np.clip(np.round(c[:, 0]), 0, None).astype(np.int64)
+    r['StdError'] = np.round(err, 1)
     return r
 
-def toSet(df, cols):
-    l = df[cols].to_numpy().tolist()
-    s = set(map(tuple, l))
+def toSet(df, cols, checkCollisions=False):
+    ## Sets are sorted arrays of (unique) row hashes
+    if (checkCollisions):
+        cDf = findCollisions([df], cols)
+        if (len(cDf) != 0):
+            raise ValueError("Hash collisions between rows:\n{}".format(cDf))
+
+    s = np.unique(hashRows(df, cols))
     return s
 
-#------------------- Private Classes & Functions ------------#
+def intersect(*sets):
+    return functools.reduce(
+        lambda x, y: np.intersect1d(x, y, assume_unique=True), sets)
 
-def _getIntersection(d, tc, fc):
-    tSets = [d[f] for f in tc]
-    fSets = [d[f] for f in fc]
+def difference(s, *sets):
+    ## Elements of s that aren't in any of the other sets
+    for x in sets:
+        s = np.setdiff1d(s, x, assume_unique=True)
 
-    ## Find the intersection between the sets we want
-    inSet = set.intersection(*tSets)
+    return s
 
-    ## Find the difference between the sets we don't want
-    if (len(fSets) != 0):
-        notIn = set.union(*fSets)
-        inSet = inSet.difference(notIn)
+def findCollisions(dfs, cols):
+    ## Rows with different values but the same hash
+    df  = pd.concat([x[cols] for x in dfs]).drop_duplicates()
+    df  = df.assign(hash=hashRows(df, cols))
+    cDf = df[df['hash'].duplicated(keep=False)]
+    cDf = cDf.sort_values('hash').reset_index(drop=True)
+    return cDf
+
+def toSketch(df, cols, precision=PRECISION):
+    sketch = HyperLogLog(precision)
+    sketch.update(hashRows(df, cols))
+    return sketch
+
+def mergeData(dfs, cols):
+    ## Outer join of tables on the key columns. Gives the same table as
+    ## merging the tables one after the other, but we only match the keys
+    ## once. Keys are given a code, and each table is placed by its codes
+    dfs   = list(dfs)
+    if (len(dfs) == 1):
+        return dfs[0]
+
+    kDf   = pd.concat([df[cols] for df in dfs], ignore_index=True)
+    codes = kDf.groupby(cols, sort=True, dropna=False, observed=True).ngroup()
+    codes = codes.to_numpy()
+    numKeys = int(codes.max()) + 1 if len(codes) != 0 else 0
+    codes   = np.split(codes, np.cumsum([len(df) for df in dfs])[:-1])
+
+    ## Duplicate keys within a table produce all combinations of rows
+    ## when merged. That's rare enough to leave to pandas
+    if (any((np.bincount(c, minlength=1) > 1).any() for c in codes)):
+        f = lambda x, y: x.merge(y, on=cols, how='outer')
+        return functools.reduce(f, dfs)
+
+    ## Keys are sorted, like they would be after an outer merge
+    allCodes = np.concatenate(codes)
+    idx      = np.empty(numKeys, dtype=np.int64)
+    idx[allCodes[::-1]] = np.arange(len(allCodes))[::-1]
+    dDfs     = [kDf.iloc[idx].reset_index(drop=True)]
+    colNames = {}
+    for df, c in zip(dfs, codes):
+        ## Position of each key in the table (-1 == missing)
+        pos    = np.full(numKeys, -1, dtype=np.int64)
+        pos[c] = np.arange(len(c))
+        vDf    = df.drop(columns=cols)
+        vDf    = pd.DataFrame({n:pd.api.extensions.take(vDf[n].array, pos,
+            allow_fill=True) for n in vDf.columns})
+
+        ## Columns with the same name are suffixed, like a pairwise merge
+        for n in vDf.columns:
+            if (n in colNames):
+                if (n + '_x' in colNames or n + '_y' in colNames):
+                    errMsg = "Duplicate columns after suffixing ({})".format(n)
+                    raise ValueError(errMsg)
+
+                i = colNames.pop(n)
+                dDfs[i] = dDfs[i].rename(columns={n:n + '_x'})
+                vDf     = vDf.rename(columns={n:n + '_y'})
+                colNames[n + '_x'] = i
+
+        colNames.update({n:len(dDfs) for n in vDf.columns})
+        dDfs.append(vDf)
+
+    dDf = pd.concat(dDfs, axis=1)
+    return dDf
+
+def hashRows(df, cols):
+    ## 64-bit hash of each row. Rows with the same values have the same
+    ## hash, regardless of the table (or process) they come from
+    h = pd.util.hash_pandas_object(df[cols], index=False)
+    return h.to_numpy()
 
-    r = {f:True for f in tc}
-    r['Count'] = len(inSet)
+#------------------- Private Classes & Functions ------------#
+
+def _getSetMasks(sets):
+    masks = collections.defaultdict(int)
+    for i, s in enumerate(sets):
+        bit = 1 << i
+        for x in s:
+            masks[x] |= bit
+
+    masks = np.fromiter(masks.values(), dtype=np.int64, count=len(masks))
+    return masks
+
+def _getArrayMasks(sets):
+    ## Sort the elements of every set together; copies of the same
+    ## element end up next to each other
+    elems = np.concatenate(sets)
+    bits  = np.concatenate([np.full(len(s), 1 << i, dtype=np.int64)
+                            for i, s in enumerate(sets)])
+    idx   = np.argsort(elems, kind='stable')
+    (elems, bits) = (elems[idx], bits[idx])
+    if (len(elems) == 0):
+        return bits
+
+    starts = np.flatnonzero(np.diff(elems, prepend=elems[:1] + 1) != 0)
+    masks  = np.bitwise_or.reduceat(bits, starts)
+    return masks
+
+def _getCombinations(numSets):
+    ## Bitmasks of every combination of sets in the order of
+    ## itertools.combinations (i.e., all singles, then all pairs, etc...)
+    combs = [itertools.combinations(range(numSets), i)
+             for i in range(1, numSets + 1)]
+    combs = itertools.chain(*combs)
+    combs = np.array([sum(1 << i for i in c) for c in combs], dtype=np.int64)
+    return combs
+
+def _getCountTable(keys, combs):
+    r = {k:((combs >> i) & 1).astype(bool) for i, k in enumerate(keys)}
+    r = pd.DataFrame(r)
     return r
 
 #------------------- Main -----------------------------------#
@@ -0,0 +1,191 @@
+#!/bin/python
+
+#------------------- Description & Notes --------------------#
+
+'''
+Index of genomic intervals (i.e., transcripts) for batch overlap,
+containment and nearest feature queries. Intervals are closed, like
+GTF/GFF coordinates (i.e., [start, end]).
+
+Intervals of each contig (and strand) are sorted by their start and we
+keep the running maximum of their ends. For a query [s, e], only
+intervals between the first one whose running maximum end >= s and
+the last one whose start <= e can overlap with it. Both are found by
+binary search, and candidates are checked all at once with numpy.
+
+The index only holds numpy arrays, so it can be pickled and sent to
+worker processes (i.e., Spark broadcast variables).
+'''
+
+#------------------- Dependencies ---------------------------#
+
+# Standard library imports
+
+# External imports
+import numpy as np
+import pandas as pd
+
+# Internal imports
+
+#------------------- Constants ------------------------------#
+
+## Placeholder for intervals (or queries) without a strand
+NO_STRAND = '.'
+
+#------------------- Public Classes & Functions -------------#
+
+class IntervalIndex(object):
+
+    def __init__(self, contigs, starts, ends, strands=None):
+        contigs = np.asarray(contigs, dtype=object)
+        starts  = np.asarray(starts, dtype=np.int64)
+        ends    = np.asarray(ends, dtype=np.int64)
+        strands = np.full(len(contigs), None, dtype=object) \
+            if strands is None else np.asarray(strands, dtype=object)
+
+        self.isStranded = any(s is not None for s in strands)
+        self.groups     = {}
+        for k, idx in _groupByKey(contigs, strands):
+            idx    = idx[np.argsort(starts[idx], kind='stable')]
+            gEnds  = ends[idx]
+            maxIdx = _getRunningArgMax(gEnds)
+            self.groups[k] = (starts[idx], gEnds, gEnds[maxIdx], maxIdx, idx)
+
+    def __len__(self):
+        return sum(len(g[0]) for g in self.groups.values())
+
+    def overlaps(self, contigs, starts, ends, strands=None):
+        ## Intervals that overlap each query
+        ## Returns pairs of (query, interval) row numbers
+        f = lambda g, s, e: _findCandidates(g, e, s)
+        return self._query(f, contigs, starts, ends, strands)
+
+    def contains(self, contigs, starts, ends, strands=None):
+        ## Intervals that contain each query (i.e., reads within transcripts)
+        ## Returns pairs of (query, interval) row numbers
+        f = lambda g, s, e: _findCandidates(g, s, e)
+        return self._query(f, contigs, starts, ends, strands)
+
+    def nearest(self, contigs, starts, ends, strands=None):
+        ## Closest interval to each query. Returns the interval row number
+        ## (-1 if there are none) and distance (0 if they overlap)
+        nearestIdx  = np.full(len(starts), -1, dtype=np.int64)
+        nearestDist = np.full(len(starts), np.iinfo(np.int64).max)
+        for g, qIdx in self._getQueryGroups(contigs, strands):
+            s = np.asarray(starts, dtype=np.int64)[qIdx]
+            e = np.asarray(ends, dtype=np.int64)[qIdx]
+            (i, d) = _findNearest(g, s, e)
+
+            ## Queries can be searched against several groups
+            ## (i.e., both strands) so we keep the closest one
+            isCloser = (i != -1) & (d < nearestDist[qIdx])
+            nearestIdx[qIdx[isCloser]]  = i[isCloser]
+            nearestDist[qIdx[isCloser]] = d[isCloser]
+
+        nearestDist[nearestIdx == -1] = -1
+        return (nearestIdx, nearestDist)
+
+    def _query(self, f, contigs, starts, ends, strands):
+        starts = np.asarray(starts, dtype=np.int64)
+        ends   = np.asarray(ends, dtype=np.int64)
+        qIdxs  = []
+        iIdxs  = []
+        for g, qIdx in self._getQueryGroups(contigs, strands):
+            (q, i) = f(g, starts[qIdx], ends[qIdx])
+            qIdxs.append(qIdx[q])
+            iIdxs.append(i)
+
+        if (len(qIdxs) == 0):
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+        ## Sort pairs by query. Intervals of each query are
+        ## in order of their start
+        qIdxs = np.concatenate(qIdxs)
+        iIdxs = np.concatenate(iIdxs)
+        idx   = np.argsort(qIdxs, kind='stable')
+        return (qIdxs[idx], iIdxs[idx])
+
+    def _getQueryGroups(self, contigs, strands):
+        ## Queries without a strand are searched against both strands
+        contigs = np.asarray(contigs, dtype=object)
+        if (not self.isStranded or strands is None):
+            strands = np.full(len(contigs), None, dtype=object)
+
+        else:
+            strands = np.asarray(strands, dtype=object)
+
+        for (c, s), qIdx in _groupByKey(contigs, strands):
+            for k, g in self.groups.items():
+                if (k[0] == c and (s is None or k[1] == s)):
+                    yield (g, qIdx)
+
+#------------------- Private Classes & Functions ------------#
+
+def _groupByKey(contigs, strands):
+    ## Missing strands (i.e., None) are replaced so that they get a code
+    ## of their own. Older versions of pandas can't keep them otherwise
+    strands = np.where(pd.isna(strands), NO_STRAND, strands)
+    (cCodes, cUniques) = pd.factorize(contigs)
+    (sCodes, sUniques) = pd.factorize(strands)
+    codes = cCodes * len(sUniques) + sCodes
+    idx   = np.argsort(codes, kind='stable')
+    (keys, offsets) = np.unique(codes[idx], return_index=True)
+    for k, i in zip(keys, np.split(idx, offsets[1:])):
+        (c, s) = divmod(int(k), len(sUniques))
+        s = None if sUniques[s] == NO_STRAND else sUniques[s]
+        yield ((cUniques[c], s), i.astype(np.int64))
+
+def _getRunningArgMax(x):
+    ## Index of the maximum of x[:i + 1] for each i
+    if (len(x) == 0):
+        return np.empty(0, dtype=np.int64)
+
+    m   = np.maximum.accumulate(x)
+    idx = np.where(x == m, np.arange(len(x)), 0)
+    return np.maximum.accumulate(idx)
+
+def _findCandidates(g, maxStart, minEnd):
+    ## Intervals with start <= maxStart and end >= minEnd
+    ## * Overlap:     maxStart = query end,   minEnd = query start
+    ## * Containment: maxStart = query start, minEnd = query end
+    (starts, ends, maxEnds, _, ids) = g
+    lo = np.searchsorted(maxEnds, minEnd, side='left')
+    hi = np.searchsorted(starts, maxStart, side='right')
+    n  = np.maximum(hi - lo, 0)
+
+    ## Expand each query into its range of candidates
+    q = np.repeat(np.arange(len(maxStart)), n)
+    c = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + np.repeat(lo, n)
+    isHit = (ends[c] >= minEnd[q])
+    return (q[isHit], ids[c[isHit]])
+
+def _findNearest(g, qStarts, qEnds):
+    (starts, ends, maxEnds, maxIdx, ids) = g
+    hi = np.searchsorted(starts, qEnds, side='right')
+
+    ## Of the intervals starting before the query ends,
+    ## the one that ends last is the closest
+    hasLeft  = (hi > 0)
+    lIdx     = np.where(hasLeft, hi - 1, 0)
+    lDist    = np.where(hasLeft, np.maximum(qStarts - maxEnds[lIdx], 0),
+        np.iinfo(np.int64).max)
+
+    ## Of the intervals starting after the query ends,
+    ## the one that starts first is the closest
+    hasRight = (hi < len(starts))
+    rIdx     = np.where(hasRight, hi, 0)
+    rDist    = np.where(hasRight, starts[rIdx] - qEnds,
+        np.iinfo(np.int64).max)
+
+    isLeft = (lDist <= rDist)
+    i = np.where(isLeft, maxIdx[lIdx], rIdx)
+    d = np.where(isLeft, lDist, rDist)
+    i = np.where(hasLeft | hasRight, ids[i], -1)
+    return (i, d)
+
+#------------------- Main -----------------------------------#
+
+if (__name__ == "__main__"):
+    main()
+
+#------------------------------------------------------------------------------
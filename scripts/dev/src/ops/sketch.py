@@ -0,0 +1,305 @@
+#!/bin/python
+
+#------------------- Description & Notes --------------------#
+
+'''
+HyperLogLog sketches for estimating the number of distinct elements
+in datasets that are too big to hold as sets. Elements are added as
+64-bit hashes (see ops.hashRows). Sketches with the same precision
+can be merged to estimate the size of the union of datasets.
+
+The relative standard error of an estimate is ~1.04 / sqrt(2^precision)
+(i.e., ~0.8% for precision=14, which uses 16KB per sketch).
+
+Estimates derived from several unions (i.e., with inclusion-exclusion)
+have errors that are hard to work out analytically. Instead, we split
+the registers of each sketch into buckets; each bucket is a smaller,
+independent sketch of a random subset of the data. The spread of the
+bucket estimates tells us how much the full estimate can be trusted.
+
+Quantile sketches (KLL) estimate quantiles (i.e., medians) of datasets
+that are too big to sort. Values are kept in levels; whenever a level
+is full, it's sorted and every other value is promoted to the next level
+(where each value stands for twice as many values). The rank of an
+estimate is within ~relError * N of the exact rank. Sketches hold
+O(1 / relError) values and can be merged, as can Summaries (i.e.,
+min, max and mean).
+'''
+
+#------------------- Dependencies ---------------------------#
+
+# Standard library imports
+import itertools
+import math
+
+# External imports
+import numpy as np
+
+# Internal imports
+
+#------------------- Constants ------------------------------#
+
+MIN_PRECISION = 8
+MAX_PRECISION = 18
+PRECISION     = 14
+
+## Registers are split into buckets to measure the error of estimates
+NUM_BUCKETS   = 16
+
+## Unions of every combination of sketches are estimated (i.e., 2^n of
+## them), so the number of sketches is limited. 20 sketches take about a
+## minute (precision=14). Combinations are worked out in blocks of
+## (roughly) UNION_BLOCK_SIZE registers
+MAX_SETS         = 20
+UNION_BLOCK_SIZE = 1 << 22
+
+## Relative (rank) error of quantile sketches. The size of the first
+## level is (roughly) RANK_ERROR / relError, and the size of each level
+## decreases by CAPACITY_DECAY
+REL_ERROR      = 0.0001
+RANK_ERROR     = 2
+CAPACITY_DECAY = 2 / 3
+MIN_CAPACITY   = 2
+
+#------------------- Public Classes & Functions -------------#
+
+class HyperLogLog(object):
+
+    def __init__(self, precision=PRECISION):
+        if (precision < MIN_PRECISION or precision > MAX_PRECISION):
+            errMsg = "Invalid precision. Must be between {} and {}" \
+                .format(MIN_PRECISION, MAX_PRECISION)
+            raise ValueError(errMsg)
+
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @property
+    def stdError(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def update(self, hashes):
+        ## The first p bits of each hash select a register, and the register
+        ## keeps the highest position of the first 1-bit in the remaining bits
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        p      = np.uint64(self.precision)
+        idx    = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        ranks  = _getLeadingZeros(hashes << p) + 1
+        ranks  = np.minimum(ranks, 64 - self.precision + 1).astype(np.uint8)
+        np.maximum.at(self.registers, idx, ranks)
+        return self
+
+    def merge(self, other):
+        if (self.precision != other.precision):
+            raise ValueError("Sketches must have the same precision")
+
+        sketch = HyperLogLog(self.precision)
+        sketch.registers = np.maximum(self.registers, other.registers)
+        return sketch
+
+    def count(self):
+        return float(getEstimate(self.registers))
+
+def getEstimate(registers):
+    ## Registers can also be a 2D array (i.e., one sketch per row)
+    m    = registers.shape[-1]
+    sums = np.sum(np.ldexp(1.0, -registers.astype(np.int64)), axis=-1)
+    numZeros = np.count_nonzero(registers == 0, axis=-1)
+    return _getEstimate(sums, numZeros, m)
+
+def getUnionEstimates(sketches, numBuckets=NUM_BUCKETS):
+    ## Estimate the size of the union of every combination of sketches.
+    ## Combinations are indexed by bitmask (i.e., 0b101 == sketches 0 and 2)
+    ## The first column contains the estimates of the full sketches and the
+    ## remaining columns contain the (scaled) estimates of each bucket.
+    ## There are 2^n combinations, so we only allow up to MAX_SETS sketches
+    n = len(sketches)
+    if (n > MAX_SETS):
+        errMsg = "Too many sketches ({}). Must be at most {}" \
+            .format(n, MAX_SETS)
+        raise ValueError(errMsg)
+
+    u = np.zeros((1 << n, numBuckets + 1), dtype=np.float64)
+    if (n == 0):
+        return u
+
+    ## The registers of each combination are the registers of the
+    ## combination without its last sketch, merged with that sketch. We
+    ## keep the combinations of the first k sketches (i.e., a block) and
+    ## merge the block with each combination of the remaining sketches
+    m  = len(sketches[0].registers)
+    k  = min(n, int(math.log2(max(UNION_BLOCK_SIZE // m, 1))))
+    lo = np.zeros((1 << k, m), dtype=np.uint8)
+    for j in range(k):
+        lo[1 << j:2 << j] = np.maximum(lo[:1 << j], sketches[j].registers)
+
+    def f(i, mask, registers):
+        r = lo if registers is None else np.maximum(lo, registers)
+        u[mask:mask + (1 << k)] = _getBlockEstimates(r, numBuckets)
+        for j in range(i, n):
+            x = sketches[j].registers if registers is None \
+                else np.maximum(registers, sketches[j].registers)
+            f(j + 1, mask | (1 << j), x)
+
+    f(k, 0, None)
+    return u
+
+class QuantileSketch(object):
+
+    def __init__(self, relError=REL_ERROR, seed=None):
+        if (relError <= 0 or relError >= 1):
+            raise ValueError("Invalid relative error. Must be between 0 and 1")
+
+        self.relError = relError
+        self.k        = math.ceil(RANK_ERROR / relError)
+        self.levels   = [np.empty(0, dtype=np.float64)]
+        self.rng      = np.random.default_rng(seed)
+
+    def __len__(self):
+        ## Number of values that have been added
+        return sum(len(l) << h for h, l in enumerate(self.levels))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compact()
+        return self
+
+    def merge(self, other):
+        if (self.relError != other.relError):
+            raise ValueError("Sketches must have the same relative error")
+
+        sketch = QuantileSketch(self.relError)
+        sketch.rng    = self.rng
+        sketch.levels = [np.concatenate([x, y]) for x, y in
+                         itertools.zip_longest(self.levels, other.levels,
+                             fillvalue=np.empty(0, dtype=np.float64))]
+        sketch._compact()
+        return sketch
+
+    def quantile(self, q):
+        ## Smallest value whose (estimated) rank is >= q * N
+        ## Returns None if there are no values
+        values  = np.concatenate(self.levels)
+        if (len(values) == 0):
+            return None
+
+        weights = np.concatenate([np.full(len(l), 1 << h, dtype=np.int64)
+                                  for h, l in enumerate(self.levels)])
+        idx     = np.argsort(values, kind='stable')
+        ranks   = np.cumsum(weights[idx])
+        i       = np.searchsorted(ranks, q * ranks[-1], side='left')
+        return float(values[idx[min(i, len(idx) - 1)]])
+
+    def _compact(self):
+        ## Lower levels have less capacity than higher levels
+        h = 0
+        while (h < len(self.levels)):
+            level = self.levels[h]
+            n     = len(self.levels) - h - 1
+            cap   = max(math.ceil(self.k * CAPACITY_DECAY ** n), MIN_CAPACITY)
+            if (len(level) > cap):
+                ## Keep one value when there's an odd number of them
+                level = np.sort(level)
+                (level, rest) = (level[:len(level) // 2 * 2],
+                                 level[len(level) // 2 * 2:])
+                if (h + 1 == len(self.levels)):
+                    self.levels.append(np.empty(0, dtype=np.float64))
+
+                o = self.rng.integers(2)
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1],
+                    level[o::2]])
+                self.levels[h] = rest
+
+            h += 1
+
+class Summary(object):
+
+    ## Min, max and mean of a dataset. Values are returned as python
+    ## types (i.e., int or float), or None if there are no values
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min   = None
+        self.max   = None
+
+    @property
+    def mean(self):
+        return None if self.count == 0 else self.total / self.count
+
+    def update(self, values):
+        values = np.asarray(values)
+        if (len(values) == 0):
+            return self
+
+        other = Summary()
+        other.count = len(values)
+        other.total = float(values.sum())
+        other.min   = values.min().item()
+        other.max   = values.max().item()
+        return self._update(other)
+
+    def merge(self, other):
+        summary = Summary()._update(self)
+        return summary._update(other)
+
+    def _update(self, other):
+        if (other.count == 0):
+            return self
+
+        self.min    = other.min if self.count == 0 else min(self.min, other.min)
+        self.max    = other.max if self.count == 0 else max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+        return self
+
+#------------------- Private Classes & Functions ------------#
+
+def _getLeadingZeros(x):
+    ## Number of leading zeros of each 64-bit integer. We count the bits
+    ## of each 32-bit half separately since floats can't represent
+    ## every 64-bit integer exactly
+    x  = x.astype(np.uint64)
+    hi = (x >> np.uint64(32)).astype(np.float64)
+    lo = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    hiBits = np.frexp(hi)[1]
+    loBits = np.frexp(lo)[1]
+    bits   = np.where(hi > 0, 32 + hiBits, loBits)
+    return 64 - bits
+
+def _getBlockEstimates(registers, numBuckets):
+    ## Estimates of a block of sketches (i.e., one per row), and of each of
+    ## their buckets. Both come from the sums of each bucket, so we only go
+    ## through the registers once
+    (n, m) = registers.shape
+    e    = np.empty((n, numBuckets + 1), dtype=np.float64)
+    r    = registers.reshape(n, numBuckets, -1)
+    sums = np.sum(_getPowers(r), axis=-1, dtype=np.float64)
+    numZeros = np.count_nonzero(r == 0, axis=-1)
+    e[:, 0]  = _getEstimate(sums.sum(axis=-1), numZeros.sum(axis=-1), m)
+    e[:, 1:] = _getEstimate(sums, numZeros, m // numBuckets) * numBuckets
+    return e
+
+def _getPowers(registers):
+    ## 2^-register as 32-bit floats, which we build from their bits (i.e.,
+    ## an exponent of 127 - register). Much quicker than np.ldexp
+    e = (np.uint8(127) - registers).astype(np.uint32) << np.uint32(23)
+    return e.view(np.float32)
+
+def _getEstimate(sums, numZeros, m):
+    ## Sums of 2^-register and the number of empty registers of each sketch
+    alpha = 0.7213 / (1 + 1.079 / m)
+    e     = alpha * m * m / sums
+
+    ## Use linear counting for small cardinalities
+    lc = m * np.log(m / np.maximum(numZeros, 1))
+    e  = np.where((e <= 2.5 * m) & (numZeros != 0), lc, e)
+    return e
+
+#------------------- Main -----------------------------------#
+
+if (__name__ == "__main__"):
+    main()
+
+#------------------------------------------------------------------------------
@@ -1,21 +1,20 @@
-#!/bin/python
-
-#------------------- Description & Notes --------------------#
-
-#------------------- Dependencies ---------------------------#
-
-# Standard library imports
-
-# External imports
-
-# Internal imports
-from .spark import getSparkSession
-
-#------------------- Constants ------------------------------#
-
-#------------------- Classes & Functions --------------------#
-
-#------------------- Main -----------------------------------#
-
-
-#------------------------------------------------------------------------------
+#!/bin/python
+
+#------------------- Description & Notes --------------------#
+
+#------------------- Dependencies ---------------------------#
+
+# Standard library imports
+
+# External imports
+
+# Internal imports
+
+#------------------- Constants ------------------------------#
+
+#------------------- Classes & Functions --------------------#
+
+#------------------- Main -----------------------------------#
+
+
+#------------------------------------------------------------------------------
@@ -16,6 +16,15 @@ from .common import getMatches
 from .common import getMismatches
 from .common import getInsertions
 from .common import getDeletions
+from .common import flattenCigartuples
+from .common import parseCigarStrings
+from .common import cigarsToGenomicCoordinates
+from .common import blocksToJunctions
+from .common import blocksToTuples
+from .stats import STATS_COLS
+from .stats import getAlignmentStats
+from .stats import getAlignmentStatsTable
+from .stats import cigarsToAlignmentStats
 
 #------------------- Constants ------------------------------#
 
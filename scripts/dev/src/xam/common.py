@@ -5,15 +5,28 @@
 #------------------- Dependencies ---------------------------#
 
 # Standard library imports
+import logging
 import re
 import itertools
 
 # External imports
+import numpy as np
 
 # Internal imports
 
 #------------------- Constants ------------------------------#
 
+LOGGER = logging.getLogger(__name__)
+
+## CIGAR operations that we know about (i.e., M, I, D, N, S, H) and
+## whether they consume the reference (i.e., M, D, N)
+CIGAR_CONSUMES_REF = np.array([True, False, True, True, False, False])
+CIGAR_SKIP         = 3
+
+## Operation of each CIGAR character (i.e., MIDNSHP=X)
+CIGAR_CODES = np.full(256, -1, dtype=np.int64)
+CIGAR_CODES[[ord(x) for x in 'MIDNSHP=X']] = np.arange(9)
+
 #------------------- Public Classes & Functions -------------#
 
 def getSoftClipCount(cigarString):
@@ -78,7 +91,7 @@ def getDeletions(cigarString):
     return deletions
 
 def cigartuplesToGenomicCoordinates(ref_pos, cigartuples):
-    rexStrList = []
+    rExons     = []
     rStart     = int(ref_pos)
     rEnd       = rStart - 1
 
@@ -91,13 +104,11 @@ def cigartuplesToGenomicCoordinates(ref_pos, cigartuples):
                 ## To account for this, we expand the exon-exon junction
                 rStart = rEnd + cLen + 1
                 rEnd   = rStart - 1
-                print('rEnd less than rStart. Expanding junction.')
-                print(str(ref_pos) + "\t" + str(cigartuples))
-                print(str(rStart) + "\t" + str(rEnd))
+                LOGGER.debug("rEnd less than rStart. Expanding junction. "
+                    "{}\t{}".format(ref_pos, cigartuples))
 
             else:
-                rex = "({}-{})".format(rStart, rEnd)
-                rexStrList.append(rex)
+                rExons.append((rStart, rEnd))
 
                 rStart = rEnd + cLen + 1
                 rEnd   = rStart - 1
@@ -112,13 +123,141 @@ def cigartuplesToGenomicCoordinates(ref_pos, cigartuples):
                 pass
 
             else:
-                print(cType)
-                print(cLen)
-                raise NotImplementedError("Unknown cType")
+                errMsg = "Unknown cType ({}, {})".format(cType, cLen)
+                raise NotImplementedError(errMsg)
+
+    rExons.append((rStart, rEnd))
+    return tuple(rExons)
+
+def flattenCigartuples(cigartuplesList):
+    ## Concatenate the CIGARs of many alignments into flat arrays of
+    ## operations and lengths. Operations of the i-th alignment are
+    ## ops[offsets[i]:offsets[i + 1]]
+    numOps  = np.fromiter((len(x) for x in cigartuplesList), dtype=np.int64,
+        count=len(cigartuplesList))
+    offsets = np.concatenate([[0], np.cumsum(numOps)])
+    x       = np.fromiter(itertools.chain.from_iterable(
+        itertools.chain.from_iterable(cigartuplesList)), dtype=np.int64,
+        count=2 * offsets[-1])
+    x       = x.reshape(-1, 2)
+    return (x[:, 0], x[:, 1], offsets)
+
+def parseCigarStrings(cigarStrings):
+    ## Same as flattenCigartuples, but from CIGAR strings. These are much
+    ## cheaper to get from pysam (and to send between processes) than
+    ## cigartuples. Lengths are built up one digit at a time (from the
+    ## last digit) for all operations at once
+    s       = np.frombuffer(''.join(cigarStrings).encode('ascii'),
+        dtype=np.uint8)
+    numChrs = np.fromiter((len(x) for x in cigarStrings), dtype=np.int64,
+        count=len(cigarStrings))
+    opIdx   = np.flatnonzero(s > ord('9'))
+    ops     = CIGAR_CODES[s[opIdx]]
+    if ((ops == -1).any()):
+        raise NotImplementedError("Unknown cType")
+
+    lens    = np.zeros(len(opIdx), dtype=np.int64)
+    prevIdx = np.concatenate([[-1], opIdx[:-1]])
+    (i, p)  = (opIdx - 1, 1)
+    while True:
+        isDigit = (i > prevIdx)
+        if (not isDigit.any()):
+            break
+
+        d = s[np.where(isDigit, i, 0)].astype(np.int64) - ord('0')
+        lens += np.where(isDigit, d * p, 0)
+        (i, p) = (i - 1, p * 10)
+
+    offsets = np.searchsorted(opIdx, np.concatenate([[0], np.cumsum(numChrs)]))
+    return (ops, lens, offsets)
+
+def cigarsToGenomicCoordinates(refStarts, ops, lens, offsets):
+
+    """
+    Description:
+        Same as cigartuplesToGenomicCoordinates, but for the CIGARs of
+        many alignments at once (see flattenCigartuples). Aligned blocks
+        are the reference positions between skips (i.e., exon-exon
+        junctions). Empty blocks are dropped (i.e., the junction is
+        expanded) except for the last block of each alignment
+
+    Args:
+        refStarts (array of int)
+            Reference start (1-based) of each alignment
+        ops, lens, offsets (arrays of int)
+            Flattened CIGARs of the alignments (see flattenCigartuples
+            and parseCigarStrings)
+
+    Returns:
+        (starts, ends, bOffsets) (arrays of int)
+            Blocks of each alignment. Blocks of the i-th alignment are
+            starts[bOffsets[i]:bOffsets[i + 1]]
+    """
+
+    isUnknown = (ops < 0) | (ops >= len(CIGAR_CONSUMES_REF))
+    if (isUnknown.any()):
+        i = np.flatnonzero(isUnknown)[0]
+        errMsg = "Unknown cType ({}, {})".format(ops[i], lens[i])
+        raise NotImplementedError(errMsg)
+
+    ## Reference position of each skip (i.e., exon-exon junction).
+    ## Only matches, deletions and skips consume the reference
+    numAligns = len(offsets) - 1
+    refStarts = np.asarray(refStarts, dtype=np.int64)
+    refLens   = np.where(CIGAR_CONSUMES_REF[ops], lens, 0)
+    refPos    = np.concatenate([[0], np.cumsum(refLens)])
+    totals    = refPos[offsets[1:]] - refPos[offsets[:-1]]
+    skipIdx   = np.flatnonzero(ops == CIGAR_SKIP)
+    sAlignIdx = np.searchsorted(offsets, skipIdx, side='right') - 1
+    sStarts   = refPos[skipIdx] - refPos[offsets[sAlignIdx]] \
+        + refStarts[sAlignIdx]
+
+    ## Each skip ends a block and starts the next one, so
+    ## each alignment has (# of skips + 1) blocks
+    numBlocks = np.bincount(sAlignIdx, minlength=numAligns) + 1
+    bOffsets  = np.concatenate([[0], np.cumsum(numBlocks)])
+    isFirst   = np.zeros(bOffsets[-1], dtype=bool)
+    isLast    = np.zeros(bOffsets[-1], dtype=bool)
+    isFirst[bOffsets[:-1]] = True
+    isLast[bOffsets[1:] - 1] = True
+
+    starts    = np.empty(bOffsets[-1], dtype=np.int64)
+    ends      = np.empty(bOffsets[-1], dtype=np.int64)
+    starts[isFirst]  = refStarts
+    starts[~isFirst] = sStarts + lens[skipIdx]
+    ends[isLast]     = refStarts + totals - 1
+    ends[~isLast]    = sStarts - 1
+
+    ## Drop empty blocks. These are usually special cases where theres
+    ## an insertion/clip somewhere within the exon-exon junction
+    isEmpty = (ends < starts) & ~isLast
+    if (isEmpty.any()):
+        LOGGER.debug("rEnd less than rStart. Expanded {} junctions."
+            .format(isEmpty.sum()))
+
+    bAlignIdx = np.repeat(np.arange(numAligns), numBlocks)[~isEmpty]
+    numBlocks = np.bincount(bAlignIdx, minlength=numAligns)
+    bOffsets  = np.concatenate([[0], np.cumsum(numBlocks)])
+    return (starts[~isEmpty], ends[~isEmpty], bOffsets)
+
+def blocksToJunctions(starts, ends, offsets):
+    ## Junctions are between consecutive blocks of each alignment.
+    ## Same as ops.exonsToJunctions, but for many alignments at once
+    numBlocks = np.diff(offsets)
+    isFirst   = np.zeros(offsets[-1], dtype=bool)
+    isLast    = np.zeros(offsets[-1], dtype=bool)
+    isFirst[offsets[:-1][numBlocks != 0]] = True
+    isLast[offsets[1:][numBlocks != 0] - 1] = True
+
+    numJuns   = np.maximum(numBlocks - 1, 0)
+    jOffsets  = np.concatenate([[0], np.cumsum(numJuns)])
+    return (ends[~isLast], starts[~isFirst], jOffsets)
 
-    rex = "({}-{})".format(rStart, rEnd)
-    rexStrList.append(rex)
-    return rexStrList
+def blocksToTuples(starts, ends, offsets):
+    ## Blocks of each alignment as a tuple of (start, end) pairs
+    blocks = list(zip(starts.tolist(), ends.tolist()))
+    return [tuple(blocks[i:j])
+            for i, j in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
 
 #------------------- Private Classes & Functions ------------#
 
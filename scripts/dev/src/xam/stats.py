@@ -0,0 +1,258 @@
+#!/bin/python
+
+#------------------- Description & Notes --------------------#
+
+'''
+Clip, match, mismatch, insertion and deletion statistics of alignments.
+Clips, insertions and deletions come from the CIGAR and matches and
+mismatches come from the MD tag.
+
+Mismatches are runs of mismatched bases. These follow getMismatches
+(which we've always used), i.e.,:
+* Mismatches separated by '0' belong to the same run (i.e., 10A0C5 has
+  one run of 2 mismatches)
+* Deletions don't break a run (i.e., 10A^T0C5 has one run of 2 mismatches)
+* Matches between two deletions don't break a run either
+  (i.e., 10A^T5^G0C5 has one run of 2 mismatches)
+'''
+
+#------------------- Dependencies ---------------------------#
+
+# Standard library imports
+import re
+import string
+
+# External imports
+import numpy as np
+import pandas as pd
+
+# Internal imports
+from .common import flattenCigartuples
+
+#------------------- Constants ------------------------------#
+
+## CIGAR operations
+CINS       = 1
+CDEL       = 2
+CSOFT_CLIP = 4
+CHARD_CLIP = 5
+
+## Tokens of the MD tag
+MD_MATCHES    = re.compile('[0-9]+')
+MD_MISMATCHES = re.compile('[A-Z]+')
+MD_ZEROS      = re.compile('(?<![0-9])0(?![0-9])')
+
+## Characters of the MD tag (for processing many tags at once)
+MD_DIGIT  = 0
+MD_LETTER = 1
+MD_CARET  = 2
+MD_SEP    = 3
+MD_CLASSES = np.full(256, MD_SEP, dtype=np.uint8)
+MD_CLASSES[ord('0'):ord('9') + 1] = MD_DIGIT
+MD_CLASSES[ord('A'):ord('Z') + 1] = MD_LETTER
+MD_CLASSES[ord('^')]              = MD_CARET
+
+## Columns of the statistics table
+STATS_COLS = ['softClipCount', 'hardClipCount', 'totalClips',
+    'matchCount', 'mismatchCount', 'insertionCount', 'deletionCount',
+    'minMismatchLen', 'maxMismatchLen', 'avgMismatchLen',
+    'minInsertionLen', 'maxInsertionLen', 'avgInsertionLen',
+    'minDeletionLen', 'maxDeletionLen', 'avgDeletionLen']
+
+#------------------- Public Classes & Functions -------------#
+
+def getAlignmentStats(cigartuples, mdTag):
+
+    """
+    Description:
+        Statistics of an alignment
+
+    Args:
+        cigartuples (list of (int, int))
+            CIGAR operations and their lengths
+        mdTag (str)
+            MD tag of the alignment
+
+    Returns:
+        stats (dict)
+            Counts and (min, max, avg) run lengths. See STATS_COLS
+    """
+
+    ## Clips, insertions and deletions
+    (sClipCount, hClipCount) = (0, 0)
+    (i, d) = ([], [])
+    for cType, cLen in cigartuples:
+        if (cType == CINS):
+            i.append(cLen)
+
+        elif (cType == CDEL):
+            d.append(cLen)
+
+        elif (cType == CSOFT_CLIP):
+            sClipCount += cLen
+
+        elif (cType == CHARD_CLIP):
+            hClipCount += cLen
+
+    ## Matches and mismatches. We drop deleted bases and matches between
+    ## deletions without any mismatches, then '0's. What's left of each
+    ## run of mismatches is a run of letters
+    mCount = sum(map(int, MD_MATCHES.findall(mdTag)))
+    pieces = mdTag.split('^')
+    pieces = [pieces[0]] + [p.lstrip(string.ascii_uppercase) for p in pieces[1:]]
+    pieces = '|'.join(p for p in pieces if not p.isdigit())
+    pieces = MD_ZEROS.sub('', pieces).replace('|', '')
+    mm     = [len(x) for x in MD_MISMATCHES.findall(pieces)]
+
+    stats = {'softClipCount':sClipCount, 'hardClipCount':hClipCount,
+             'totalClips':sClipCount + hClipCount, 'matchCount':mCount,
+             'mismatchCount':sum(mm), 'insertionCount':sum(i),
+             'deletionCount':sum(d)}
+    stats.update(_getRunStats('Mismatch', mm))
+    stats.update(_getRunStats('Insertion', i))
+    stats.update(_getRunStats('Deletion', d))
+    return stats
+
+def getAlignmentStatsTable(cigartuplesList, mdTags):
+
+    """
+    Description:
+        Statistics of many alignments. Same as getAlignmentStats, but
+        the CIGARs and MD tags of all alignments are processed at once
+
+    Args:
+        cigartuplesList (list of list of (int, int))
+            CIGAR operations and their lengths of each alignment
+        mdTags (list of str)
+            MD tag of each alignment
+
+    Returns:
+        statsDf (pd.DataFrame)
+            Statistics of each alignment (in order). See STATS_COLS
+    """
+
+    (ops, lens, offsets) = flattenCigartuples(cigartuplesList)
+    return cigarsToAlignmentStats(ops, lens, offsets, mdTags)
+
+def cigarsToAlignmentStats(ops, lens, offsets, mdTags):
+    ## Same as getAlignmentStatsTable, but from flattened CIGARs
+    ## (see flattenCigartuples, parseCigarStrings and io.xam.getTableCigars)
+    numAligns = len(mdTags)
+    alignIdx  = np.repeat(np.arange(numAligns), np.diff(offsets))
+
+    isOp = {x:(ops == x) for x in [CINS, CDEL, CSOFT_CLIP, CHARD_CLIP]}
+    f = lambda x: np.bincount(alignIdx[isOp[x]], weights=lens[isOp[x]],
+        minlength=numAligns).astype(np.int64)
+    ## Columns are collected first; adding them to a DataFrame one at
+    ## a time is slow for small batches
+    stats = {'softClipCount':f(CSOFT_CLIP), 'hardClipCount':f(CHARD_CLIP)}
+    stats['totalClips'] = stats['softClipCount'] + stats['hardClipCount']
+
+    (mCounts, mmIdx, mm) = _parseMDTags(mdTags)
+    stats['matchCount']     = mCounts
+    stats['mismatchCount']  = np.bincount(mmIdx, weights=mm,
+        minlength=numAligns).astype(np.int64)
+    stats['insertionCount'] = f(CINS)
+    stats['deletionCount']  = f(CDEL)
+
+    runs = [('Mismatch', mmIdx, mm),
+            ('Insertion', alignIdx[isOp[CINS]], lens[isOp[CINS]]),
+            ('Deletion', alignIdx[isOp[CDEL]], lens[isOp[CDEL]])]
+    for name, idx, l in runs:
+        (minL, maxL, avgL) = _getRunStatsTable(idx, l, numAligns)
+        stats['min{}Len'.format(name)] = minL
+        stats['max{}Len'.format(name)] = maxL
+        stats['avg{}Len'.format(name)] = avgL
+
+    statsDf = pd.DataFrame(stats, columns=STATS_COLS)
+    return statsDf
+
+#------------------- Private Classes & Functions ------------#
+
+def _getRunStats(name, l):
+    total = sum(l)
+    minL  = 0 if total == 0 else min(l)
+    maxL  = 0 if total == 0 else max(l)
+    avgL  = 0 if total == 0 else (total / len(l))
+    return {'min{}Len'.format(name):minL, 'max{}Len'.format(name):maxL,
+            'avg{}Len'.format(name):avgL}
+
+def _getRunStatsTable(idx, l, numAligns):
+    ## Runs are ordered by alignment
+    n     = np.bincount(idx, minlength=numAligns)
+    total = np.bincount(idx, weights=l, minlength=numAligns)
+    minL  = np.zeros(numAligns, dtype=np.int64)
+    maxL  = np.zeros(numAligns, dtype=np.int64)
+    avgL  = np.zeros(numAligns, dtype=np.float64)
+
+    hasRuns = (n != 0)
+    if (hasRuns.any()):
+        starts = (np.cumsum(n) - n)[hasRuns]
+        minL[hasRuns] = np.minimum.reduceat(l, starts)
+        maxL[hasRuns] = np.maximum.reduceat(l, starts)
+        avgL[hasRuns] = total[hasRuns] / n[hasRuns]
+
+    return (minL, maxL, avgL)
+
+def _parseMDTags(mdTags):
+    ## Split the MD tags into tokens (i.e., numbers, runs of letters and
+    ## '^'). Tags are separated by '|' so that runs of mismatches end
+    ## with their alignment
+    s   = np.frombuffer('|'.join(mdTags).encode('ascii'), dtype=np.uint8)
+    cls = MD_CLASSES[s]
+    isSep  = (cls == MD_SEP)
+    isTok  = (cls != _shift(cls, 1)) | isSep | _shift(isSep, 1)
+    isTok[:1] = True
+    starts = np.flatnonzero(isTok)
+    lens   = np.diff(np.append(starts, len(s)))
+    tCls   = cls[starts]
+    tSep   = (tCls == MD_SEP)
+    tAlignIdx = np.cumsum(tSep)
+
+    ## Matches. Numbers are the sum of their digits * 10^(position
+    ## from the end of the number)
+    isDigit = (cls == MD_DIGIT)
+    pos     = np.repeat(starts + lens - 1, lens) - np.arange(len(s))
+    digits  = np.where(isDigit, s - ord('0'), 0) \
+        * (10 ** np.where(isDigit, pos, 0))
+    tDigit  = (tCls == MD_DIGIT)
+    values  = np.add.reduceat(digits, starts) if len(s) != 0 else digits
+    mCounts = np.bincount(tAlignIdx[tDigit], weights=values[tDigit],
+        minlength=len(mdTags)).astype(np.int64)
+
+    ## Mismatches are letters that don't follow a '^' (i.e., deletions)
+    tCaret  = (tCls == MD_CARET)
+    tMm     = (tCls == MD_LETTER) & ~_shift(tCaret, 1)
+
+    ## Matches only break runs of mismatches if they're not '0' and
+    ## they're not between deletions without any mismatches
+    pieceIdx = np.cumsum(tCaret | tSep)
+    hasMm    = np.bincount(pieceIdx[tMm], minlength=len(starts) + 1) != 0
+    isZero   = tDigit & (lens == 1) & (values == 0)
+    isBreak  = (tDigit & ~isZero & hasMm[pieceIdx]) | tSep
+
+    ## Lengths of each run of mismatches
+    runIdx   = np.cumsum(isBreak)[tMm]
+    rStarts  = np.flatnonzero(np.diff(runIdx, prepend=-1) != 0)
+    mm       = np.add.reduceat(lens[tMm], rStarts) \
+        if len(rStarts) != 0 else rStarts
+    mmIdx    = tAlignIdx[tMm][rStarts]
+    return (mCounts, mmIdx, mm)
+
+def _shift(x, n):
+    ## Shifts a boolean array by n positions, filling with False
+    y = np.zeros_like(x)
+    if (n > 0):
+        y[n:] = x[:-n]
+
+    else:
+        y[:n] = x[-n:]
+
+    return y
+
+#------------------- Main -----------------------------------#
+
+if (__name__ == "__main__"):
+    main()
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,32 @@
+#!/bin/python
+
+#------------------- Description & Notes --------------------#
+
+## Shared fixtures. Tests import the package (i.e., src) the same way the
+## scripts do, so they're run from (or relative to) scripts/dev
+
+#------------------- Dependencies ---------------------------#
+
+# Standard library imports
+import sys
+from pathlib import Path
+
+# External imports
+import pytest
+
+# Internal imports
+
+#------------------- Constants ------------------------------#
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+#------------------- Public Classes & Functions -------------#
+
+@pytest.fixture(autouse=True)
+def cacheDir(tmp_path, monkeypatch):
+    ## Never touch the user's cache
+    d = tmp_path / 'cache'
+    monkeypatch.setenv('GXF_CACHE_DIR', str(d))
+    return d
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,48 @@
+#!/bin/python
+
+#------------------- Description & Notes --------------------#
+
+#------------------- Dependencies ---------------------------#
+
+# Standard library imports
+import logging
+
+# External imports
+import pandas as pd
+
+# Internal imports
+from src.io import cache
+from src.io import gxf
+from test_gxf import getMixedScoreRows
+from test_gxf import writeGtf
+
+#------------------- Constants ------------------------------#
+
+#------------------- Public Classes & Functions -------------#
+
+def test_read_multiChunkGtfRoundTrips(tmp_path, cacheDir, caplog):
+    f = str(writeGtf(tmp_path / 'a.gtf', getMixedScoreRows()))
+    with caplog.at_level(logging.WARNING):
+        fDb = next(gxf.read(f, chunksize=2))
+
+    assert caplog.records == []
+    assert len(list(cacheDir.glob('*.parquet'))) == 1
+
+    ## The second read comes from the cache
+    key = cache.getCacheKey(f, gxfType=gxf.GTF)
+    cDb = cache.read(key)
+    assert cDb is not None
+    pd.testing.assert_frame_equal(cDb, fDb.reset_index(drop=True),
+        check_dtype=False)      ## Parquet can bring back objects as strings
+    pd.testing.assert_frame_equal(next(gxf.read(f, chunksize=3)), cDb)
+
+def test_write_logsFailures(cacheDir, caplog):
+    df = pd.DataFrame({'x':[1, '.']})
+    with caplog.at_level(logging.WARNING):
+        cache.write('key', df)
+
+    assert [r.levelno for r in caplog.records] == [logging.WARNING]
+    assert 'Unable to cache table' in caplog.records[0].getMessage()
+    assert list(cacheDir.glob('*')) == []
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,104 @@
+#!/bin/python
+
+#------------------- Description & Notes --------------------#
+
+#------------------- Dependencies ---------------------------#
+
+# Standard library imports
+
+# External imports
+import pandas as pd
+
+# Internal imports
+from src import gxf as gxfOps
+from src.io import gxf
+
+#------------------- Constants ------------------------------#
+
+#------------------- Public Classes & Functions -------------#
+
+def test_read_scoreTypeChangesBetweenChunks(tmp_path):
+    ## Numeric scores in the first chunk and '.' in the second
+    f = writeGtf(tmp_path / 'a.gtf', getMixedScoreRows())
+    fDb = next(gxf.read(str(f), chunksize=2, cache=False))
+    assert fDb['score'].map(type).eq(str).all()
+    assert fDb['score'].tolist() == ['1000', '1000', '.', '.']
+
+    fDbs = list(next(gxf.read(str(f), chunksize=2, asChunks=True)))
+    assert len(fDbs) == 2
+    assert all(x['score'].map(type).eq(str).all() for x in fDbs)
+
+    fDb = next(gxf.read(str(f), chunksize=2, compact=True, cache=False))
+    assert fDb['score'].dtype == 'float32'
+    assert fDb['score'].isna().tolist() == [False, False, True, True]
+
+def test_read_inParallel(tmp_path):
+    ## Workers write their tables to Arrow files, which need the same
+    ## column types in every chunk
+    rows = getMixedScoreRows()
+    fs   = [str(writeGtf(tmp_path / 'a.gtf', rows)),
+            str(writeGtf(tmp_path / 'b.gtf', rows[::-1]))]
+    fDbs = list(gxf.read(*fs, chunksize=2, nWorkers=2, cache=False))
+    eDbs = list(gxf.read(*fs, chunksize=2, cache=False))
+    assert len(fDbs) == 2
+    for fDb, eDb in zip(fDbs, eDbs):
+        pd.testing.assert_frame_equal(fDb.reset_index(drop=True),
+            eDb.reset_index(drop=True), check_dtype=False)
+
+def test_read_regionKeepsTranscriptsCrossingItsEdges(tmp_path):
+    ## t1 crosses the end of the region, t2 is within it and t3 is outside
+    ## of it. g3 (i.e., the gene of t3) is also outside of the region
+    rows = [['chr1', 'src', 'gene', 5003000, 5004000, '.', '+', '.',
+             'gene_id "g_t3";'],
+            getTranscriptRow('chr1', 4999000, 5002000, 't1'),
+            getExonRow('chr1', 4999000, 4999500, 't1'),
+            getExonRow('chr1', 5001000, 5002000, 't1'),
+            getTranscriptRow('chr1', 4000000, 4000100, 't2'),
+            getExonRow('chr1', 4000000, 4000100, 't2'),
+            getTranscriptRow('chr1', 5003000, 5004000, 't3'),
+            getExonRow('chr1', 5003000, 5004000, 't3')]
+    f = str(writeGtf(tmp_path / 'a.gtf', rows))
+
+    fDb = next(gxf.read(f, attrs=['transcript_id', 'gene_id'],
+        region='chr1:1-5000000'))
+    assert set(fDb['transcript_id'].dropna()) == {'t1', 't2'}
+    assert 'gene' not in set(fDb['feature'])
+
+    tDf = gxfOps.getTranscripts(fDb).set_index('transcript_id')
+    assert tDf.loc['t1', 'exon_list'] == ((4999000, 4999500),
+                                          (5001000, 5002000))
+    assert (tDf.loc['t1', 'start'], tDf.loc['t1', 'end']) == (4999000, 5002000)
+
+    ## Regions starting within a transcript are widened as well
+    fDb = next(gxf.read(f, attrs=['transcript_id'], region='chr1:5001500'))
+    assert set(fDb['transcript_id'].dropna()) == {'t1', 't3'}
+    assert len(fDb) == 6
+
+#------------------- Protected Classes & Functions ----------#
+
+def getMixedScoreRows():
+    rows = []
+    for i in range(4):
+        score = '1000' if i < 2 else '.'
+        rows.append(getExonRow('chr1', 100 * i + 1, 100 * i + 50,
+            't{}'.format(i), score=score))
+
+    return rows
+
+def getExonRow(contig, start, end, tId, score='.'):
+    attr = 'gene_id "g_{0}"; transcript_id "{0}";'.format(tId)
+    return [contig, 'src', 'exon', start, end, score, '+', '.', attr]
+
+def getTranscriptRow(contig, start, end, tId):
+    row = getExonRow(contig, start, end, tId)
+    row[2] = 'transcript'
+    return row
+
+def writeGtf(f, rows):
+    with open(f, 'w') as fileHandle:
+        for r in rows:
+            fileHandle.write('\t'.join(str(x) for x in r) + '\n')
+
+    return f
+
+#------------------------------------------------------------------------------
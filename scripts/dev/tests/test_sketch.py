@@ -0,0 +1,46 @@
+#!/bin/python
+
+#------------------- Description & Notes --------------------#
+
+#------------------- Dependencies ---------------------------#
+
+# Standard library imports
+
+# External imports
+import numpy as np
+import pytest
+
+# Internal imports
+from src.ops import sketch
+
+#------------------- Constants ------------------------------#
+
+#------------------- Public Classes & Functions -------------#
+
+@pytest.mark.parametrize('blockSize', [1, 1 << 10, sketch.UNION_BLOCK_SIZE])
+def test_getUnionEstimates_matchesMergedSketches(blockSize, monkeypatch):
+    ## Small blocks split the combinations across several blocks
+    monkeypatch.setattr(sketch, 'UNION_BLOCK_SIZE', blockSize)
+    rng      = np.random.default_rng(0)
+    sketches = [sketch.HyperLogLog(8).update(
+                rng.integers(0, 1 << 62, 100 * (i + 1), dtype=np.uint64) << 1)
+                for i in range(5)]
+    u = sketch.getUnionEstimates(sketches, numBuckets=4)
+    assert u.shape == (1 << 5, 5)
+    assert (u[0] == 0).all()
+    for mask in range(1, 1 << 5):
+        r = np.zeros(1 << 8, dtype=np.uint8)
+        for j, s in enumerate(sketches):
+            if (mask >> j & 1):
+                r = np.maximum(r, s.registers)
+
+        assert u[mask, 0] == pytest.approx(sketch.getEstimate(r))
+        b = sketch.getEstimate(r.reshape(4, -1)) * 4
+        assert u[mask, 1:] == pytest.approx(b)
+
+def test_getUnionEstimates_tooManySketches():
+    sketches = [sketch.HyperLogLog(8)] * (sketch.MAX_SETS + 1)
+    with pytest.raises(ValueError, match='Too many sketches'):
+        sketch.getUnionEstimates(sketches)
+
+#------------------------------------------------------------------------------